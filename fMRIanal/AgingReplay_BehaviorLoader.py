@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Behavioral trials of the SeqMemTask session, parsed once per subject
+# ========================================================================================================================================================
+# The PsychoPy csv of a subject is parsed with column-wise string operations into one structured array, one row per trial
+# of the session (all blocks, in file order):
+#   item        - (nEle,) image names of the encoded sequence ('.../cat.png' -> 'cat')
+#   pos         - (nEle,) position names of the sequence (cueAng relabelled with AngleNames_generalB1/B2)
+#   short_wti   - sWTImark: short (1) or long (0) waiting interval
+#   wti_time    - WTItime: waiting interval in s
+#   test_order  - trlTestOrd: item first (0) or position first (1)
+#   recons_only - reconsMark: reconsOnly (1) or not (0)
+# The per-trial marks are written by PsychoPy as array strings ('[1.]'); their first number is read with one regex per
+# column. The position names follow the scripts: the unique angles are sorted, and the set of names (B1 or B2) depends on
+# whether the smallest angle lies below 2*pi/(2*nPos). If the columns hold different numbers of trials (aborted sessions:
+# a trailing partial trial, extra rows), all of them are cut to the complete trials they have in common, with a warning.
+#
+# The table is cached per subject on disk, with cache_root, as <cache_root>/<csv name>_<hash>.npy, where the hash covers the
+# csv size / mtime and the parsing settings, so every script, ROI / HRF iteration and job reads the parsed table instead of
+# the csv. The in-memory lru_cache only helps within one process: with SUBJECT_WORKERS=1 (subjects run in the main
+# process) across the ROI / HRF iterations; run_subjects() forks a fresh pool per iteration from a parent that never
+# loads the table, so pooled workers start with an empty cache and read the .npy file.
+# ========================================================================================================================================================
+
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+from AgingReplay_Checkpoint import param_hash
+
+mark_columns = {'short_wti': 'sWTImark', 'wti_time': 'WTItime', 'test_order': 'trlTestOrd', 'recons_only': 'reconsMark'}
+
+
+def behavior_dtype(nEle, name_len=32):
+    return np.dtype([
+        ('item', f'U{name_len}', (nEle,)), ('pos', f'U{name_len}', (nEle,)),
+        ('short_wti', np.int8), ('wti_time', np.float64), ('test_order', np.int8), ('recons_only', np.int8),
+    ])
+
+
+def _first_number(column):
+    """First number of every '[x y ...]' string of a csv column (the number itself if pandas already parsed it)."""
+    column = column.dropna()
+    if pd.api.types.is_numeric_dtype(column):
+        return column.to_numpy(dtype=np.float64)
+    return column.astype(str).str.extract(r'^\s*\[?\s*([^\s\[\],]+)', expand=False).astype(np.float64).to_numpy()
+
+
+def parse_behavior(smtData_pd, nEle, angle_names_B1, angle_names_B2):
+    """Structured array (one row per trial, see the header) of a SeqMemTask csv read into a DataFrame."""
+    items = smtData_pd['cueImgName'].dropna().astype(str).str.rsplit('/', n=1).str[-1].str.split('.', n=1).str[0].to_numpy()
+    angles = smtData_pd['cueAng'].dropna().to_numpy(dtype=np.float64)
+    angle_unique, angle_idx = np.unique(angles, return_inverse=True)
+    nPos = len(angle_names_B1)
+    angle_names = angle_names_B1 if angle_unique[0] < 1/(2*nPos) * 2 * np.pi else angle_names_B2 # 0-22.5 or 22.5-45 degree
+    positions = np.asarray(angle_names)[angle_idx]
+
+    marks = {field: _first_number(smtData_pd[column]) for field, column in mark_columns.items()}
+    # aborted sessions can end with a partial trial or extra rows: keep the complete trials all columns have
+    lengths = {'cueImgName': len(items) / nEle, 'cueAng': len(positions) / nEle, **{mark_columns[f]: len(v) for f, v in marks.items()}}
+    n_trial = int(min(lengths.values()))
+    if any(n != n_trial for n in lengths.values()):
+        print(f"[WARN] trials per column of the behavioral csv differ, keeping the first {n_trial}: {lengths}")
+    items, positions = items[:n_trial * nEle], positions[:n_trial * nEle]
+    marks = {field: values[:n_trial] for field, values in marks.items()}
+
+    name_len = max([32] + [len(name) for name in items] + [len(name) for name in angle_names]) # names are never truncated
+    behavior = np.zeros(n_trial, dtype=behavior_dtype(nEle, name_len))
+    behavior['item'] = items.reshape(n_trial, nEle)
+    behavior['pos']  = positions.reshape(n_trial, nEle)
+    for field, values in marks.items():
+        behavior[field] = values
+    return behavior
+
+
+@lru_cache(maxsize=8)
+def _load_behavior(smtData_fname, nEle, angle_names_B1, angle_names_B2, cache_root):
+    cache_file = None
+    if cache_root is not None:
+        st  = os.stat(smtData_fname)
+        key = param_hash({'file': os.path.abspath(smtData_fname), 'stat': [st.st_size, st.st_mtime_ns], 'nEle': nEle,
+                          'B1': angle_names_B1, 'B2': angle_names_B2})
+        cache_file = os.path.join(cache_root, os.path.splitext(os.path.basename(smtData_fname))[0] + '_' + key + '.npy')
+        if os.path.exists(cache_file):
+            behavior = np.load(cache_file)
+            behavior.flags.writeable = False
+            return behavior
+
+    behavior = parse_behavior(pd.read_csv(filepath_or_buffer=smtData_fname), nEle, angle_names_B1, angle_names_B2)
+    if cache_file is not None:
+        os.makedirs(cache_root, exist_ok=True)
+        with open(cache_file + '.tmp', 'wb') as f:
+            np.save(f, behavior)
+        os.replace(cache_file + '.tmp', cache_file)
+        print(f"[CACHE] {cache_file}")
+    behavior.flags.writeable = False # shared by every caller of the cache
+    return behavior
+
+
+def load_behavior(smtData_fname, nEle, angle_names_B1, angle_names_B2, cache_root=None):
+    """Per-trial table (structured array, see the header) of a subject's SeqMemTask csv, parsed once."""
+    return _load_behavior(smtData_fname, nEle, tuple(angle_names_B1), tuple(angle_names_B2), cache_root)
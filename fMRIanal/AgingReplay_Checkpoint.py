@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Resumable subject loops: per-unit checkpoints of the *_ROILoop_HPC.py scripts
+# ========================================================================================================================================================
+# Every (subject, ROI, HRF peak) unit that finishes is pickled right away, so a job that hits the SLURM time limit or
+# stops at one subject keeps everything done so far:
+#   <checkpoint_root>/<script>/<key>/params.json          - the settings the key was computed from
+#   <checkpoint_root>/<script>/<key>/manifest.jsonl       - one line per finished unit
+#   <checkpoint_root>/<script>/<key>/parts/<unit>.pkl     - the unit's return value (what run_subjects() collects)
+# where <key> is a hash of every script setting that changes the results (as the FeatureCache keys), so a resubmission
+# with other settings starts a new set of parts instead of reusing the old ones.
+#
+# Parts are written to a temporary file and renamed, and the manifest line is appended only after the rename; a unit
+# counts as finished if it is in the manifest and its part exists. On resubmission, Checkpoint.wrap() returns the stored
+# result of finished units without running them, so the group tables are rebuilt from the parts and only the unfinished
+# subjects are computed.
+#
+# With inputs_fn (the digest of the input files of a unit, see AgingReplay_Dependencies.py) the manifest line also keeps
+# that digest, and a unit whose masks / runs / events changed since is run again (the last manifest line of a unit wins).
+# ========================================================================================================================================================
+
+import os
+import json
+import pickle
+import hashlib
+
+CHECKPOINT_VERSION = 1
+
+
+def param_hash(params):
+    """Short sha1 of a JSON-serializable dict of settings."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def unit_name(unit):
+    """File name of a unit dict, e.g. {'sub': 'sub-03-LWVO2N', 'ROI': 'HPC', 'HRF': 5} -> 'sub-sub-03-LWVO2N_ROI-HPC_HRF-5'."""
+    return '_'.join(f"{k}-{v}" for k, v in unit.items()).replace(os.sep, '-')
+
+
+class Checkpoint:
+    """Finished units of one script under one set of settings (see the module header)."""
+
+    def __init__(self, checkpoint_root, script, params):
+        self.params   = {'version': CHECKPOINT_VERSION, **params}
+        self.key      = param_hash(self.params)
+        self.save_dir = os.path.join(checkpoint_root, script, self.key)
+        self.manifest = os.path.join(self.save_dir, 'manifest.jsonl')
+        os.makedirs(os.path.join(self.save_dir, 'parts'), exist_ok=True)
+        params_file = os.path.join(self.save_dir, 'params.json')
+        if not os.path.exists(params_file):
+            with open(params_file + '.tmp', 'w') as f:
+                json.dump(self.params, f, indent=1, default=str)
+            os.replace(params_file + '.tmp', params_file)
+
+    def part_file(self, unit):
+        return os.path.join(self.save_dir, 'parts', unit_name(unit) + '.pkl')
+
+    def finished(self):
+        """{name: inputs digest (None if untracked)} of the finished units."""
+        if not os.path.exists(self.manifest):
+            return {}
+        names = {}
+        with open(self.manifest) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    names[entry['unit']] = entry.get('inputs')
+        return {name: inputs for name, inputs in names.items() if os.path.exists(os.path.join(self.save_dir, 'parts', name + '.pkl'))}
+
+    def is_done(self, unit, inputs=None):
+        finished = self.finished()
+        return unit_name(unit) in finished and finished[unit_name(unit)] == inputs
+
+    def load(self, unit):
+        with open(self.part_file(unit), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, unit, result, inputs=None):
+        part_file = self.part_file(unit)
+        with open(part_file + '.tmp', 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(part_file + '.tmp', part_file)
+        # one short line per write, appended by whichever worker finished the unit
+        with open(self.manifest, 'a') as f:
+            f.write(json.dumps({'unit': unit_name(unit), **unit, 'inputs': inputs}, default=str) + '\n')
+
+    def wrap(self, subject_fn, unit_fn, inputs_fn=None):
+        """
+        subject_fn(subIdx) that returns the stored result of finished units and saves the result of the others.
+
+        inputs_fn(subIdx): digest of the unit's input files; a finished unit whose digest changed is run again.
+        """
+        def checkpointed_fn(subIdx):
+            unit   = unit_fn(subIdx)
+            inputs = inputs_fn(subIdx) if inputs_fn is not None else None
+            if self.is_done(unit, inputs):
+                print(f"[CHECKPOINT] {unit_name(unit)}: finished in an earlier run, read from {self.save_dir}")
+                return self.load(unit)
+            result = subject_fn(subIdx)
+            self.save(unit, result, inputs)
+            return result
+        return checkpointed_fn
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Split-half cross-trial correlation of the masked SMT tensor
+# ========================================================================================================================================================
+# Used by AgingReplay_SMT_CrossTrialCorr_ROILoop_HPC.py; kept in its own module so that it can be imported without
+# running the subject loop (test_precision.py). The trial means are accumulated in float64 whatever the dtype of the
+# tensor (feature_dtype, float32 by default).
+# ========================================================================================================================================================
+
+import numpy as np
+
+
+def split_half_cross_corr(data, trial_numbers, nTR_p, n_repeats, rng=None, batch_size=100):
+    """
+    Split-half cross-trial correlation for all TR pairs and all repeats at once.
+
+    data: (nTrials, n_voxels, nTR) masked SMT tensor; trial_numbers: trials of one sequence.
+    In every repeat the trials are randomly split in two halves; the half-1 mean at TR i (Encoding) is
+    correlated with the half-2 mean at TR j (WTI) across voxels. One permutation is shared by all
+    nTR_p x nTR_p pairs of a repeat (the loop version drew one per pair; the average over repeats has
+    the same expectation).
+    Returns corr, cos_sim: (nTR_p, nTR_p, n_repeats). The cosine similarity of the voxel-centred
+    patterns equals the Pearson correlation, so both come from the same normalised matrix product.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    trial_numbers = np.asarray(trial_numbers)
+    n_trials = len(trial_numbers)
+    half     = n_trials // 2
+
+    # (n_trials, n_voxels * nTR_p); nanmean = sum over finite values / number of finite values
+    X = data[trial_numbers][:, :, :nTR_p]
+    n_voxels = X.shape[1]
+    finite = np.isfinite(X)
+    X_sum  = np.where(finite, X, 0.0).reshape(n_trials, -1).astype(np.float64) # trial sums in float64 (the tensor is feature_dtype)
+    X_cnt  = finite.reshape(n_trials, -1).astype(float)
+
+    corr = np.full((n_repeats, nTR_p, nTR_p), np.nan)
+    for r0 in range(0, n_repeats, batch_size):
+        n_rep = min(batch_size, n_repeats - r0)
+        # ------ random split of the trials for every repeat: (n_rep, n_trials) 0/1 weights ------
+        order = np.argsort(rng.random((n_rep, n_trials)), axis=1)
+        w1 = np.zeros((n_rep, n_trials))
+        np.put_along_axis(w1, order[:, :half], 1.0, axis=1)
+        w2 = 1.0 - w1
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean1 = ((w1 @ X_sum) / (w1 @ X_cnt)).reshape(n_rep, n_voxels, nTR_p)
+            mean2 = ((w2 @ X_sum) / (w2 @ X_cnt)).reshape(n_rep, n_voxels, nTR_p)
+
+            # ------ centre across voxels and scale to unit length: correlation = dot product ------
+            mean1 = mean1 - mean1.mean(axis=1, keepdims=True)
+            mean2 = mean2 - mean2.mean(axis=1, keepdims=True)
+            mean1 = mean1 / np.linalg.norm(mean1, axis=1, keepdims=True)
+            mean2 = mean2 / np.linalg.norm(mean2, axis=1, keepdims=True)
+            corr[r0 : r0 + n_rep] = np.einsum('rvi,rvj->rij', mean1, mean2)
+
+    corr = np.transpose(corr, (1, 2, 0))
+    return corr, corr.copy()
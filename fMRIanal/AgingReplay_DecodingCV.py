@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Leave-one-run-out cross-validation engine for the localizer decoders
+# ========================================================================================================================================================
+# Each LOGO fold fits one clone of the decoding pipeline, and everything is read from that fit:
+#   folds     - DataFrame, one row per fold: held-out run, accuracy, n_train, n_test, fit_time, score_time (s),
+#               n_iter and converged of the solver, warm_started
+#   proba     - (n_samples, n_classes) out-of-fold class probabilities (every sample is tested exactly once)
+#   confusion - (n_folds, n_classes, n_classes) confusion matrix per fold (rows: true, columns: predicted)
+#   classes   - the class labels of the proba/confusion columns
+#
+# Warm start (LogisticRegression with lbfgs): logo_cv(..., warm_start=<result of the previous HRF peak>) starts every
+# fold from the coefficients of the same fold at the neighbouring HRF peak, i.e. from a fit on the same training runs.
+# Warm starts across folds (from the previous fold, or from a fit on all runs) are deliberately not offered: those
+# fits have seen the held-out run, and with voxels >> samples lbfgs stops within its tolerance right at that solution,
+# so the accuracy is inflated (on synthetic chance-level data: ~0.15 cold vs. 0.9-1.0 warm).
+# Coefficients are carried over in the full voxel space, so they also apply when ReliabilitySelector keeps different
+# voxels at different HRF peaks (voxels new to a fold start at 0).
+#
+# Dual decoders (DualClassifier, see AgingReplay_DualDecoder.py): when no step before the classifier changes X (no
+# scaler, no voxel selection), the Gram matrix X X^T is computed once and every fold fits on its training block.
+#
+# Folds run on a thread pool; numpy/scipy release the GIL in the BLAS calls that dominate lbfgs on wide ROI matrices,
+# and the BLAS threads per fold are set explicitly (blas_threads) so n_jobs x blas_threads stays within the CPUs given.
+#
+# check_cv_equivalence() re-runs sklearn's cross_validate on the same pipeline and compares the fold accuracies; the
+# decoding script calls it only with --check-cv, so the classifier is normally fitted once per fold.
+# check_precision_drift() re-runs the folds on a float64 copy of X (the features are float32 by default, see
+# AgingReplay_FeatureCache.py) and bounds the change of the mean accuracy (--check-precision).
+# ========================================================================================================================================================
+
+import time
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+from sklearn.base import clone
+from sklearn.metrics import confusion_matrix
+from sklearn.model_selection import LeaveOneGroupOut, cross_validate
+from AgingReplay_DualDecoder import DualClassifier, gram_matrix
+
+
+def _feature_idx(pipe, n_features):
+    """Columns of the input X that reach the classifier (ReliabilitySelector.voxel_idx_), after fitting."""
+    feature_idx = np.arange(n_features)
+    for _, step in pipe.steps[:-1]:
+        if getattr(step, 'top_frac', None) is not None and step.top_frac < 1:
+            feature_idx = feature_idx[step.voxel_idx_]
+    return feature_idx
+
+
+def _full_space_coef(pipe, n_features):
+    """(classes, coef, intercept) of a fitted pipeline, with coef in the space of all input features (0 where dropped)."""
+    clf  = pipe.steps[-1][1]
+    coef = np.zeros((clf.coef_.shape[0], n_features))
+    coef[:, _feature_idx(pipe, n_features)] = clf.coef_
+    return clf.classes_, coef, clf.intercept_.copy()
+
+
+def reuses_gram(pipeline):
+    """True if the pipeline ends in a DualClassifier and the steps before it pass X through unchanged."""
+    return isinstance(pipeline.steps[-1][1], DualClassifier) and all(
+        step in (None, 'passthrough') or (hasattr(step, 'top_frac') and (step.top_frac is None or step.top_frac >= 1))
+        for _, step in pipeline.steps[:-1]
+    )
+
+
+def _fit_pipeline(pipeline, X, y, init=None, gram=None):
+    """
+    Fit a clone of the pipeline, starting the classifier from init=(classes, full-space coef, intercept) if given;
+    gram (X X^T of these samples) goes to a DualClassifier.
+    """
+    pipe = clone(pipeline)
+    Xt   = pipe[:-1].fit_transform(X, y) if len(pipe.steps) > 1 else X
+    clf  = pipe.steps[-1][1]
+    warm_started = init is not None and 'warm_start' in clf.get_params() and np.array_equal(init[0], np.unique(y))
+    if warm_started:
+        clf.set_params(warm_start=True)
+        clf.coef_      = init[1][:, _feature_idx(pipe, X.shape[1])]
+        clf.intercept_ = init[2].copy()
+    if gram is not None:
+        clf.fit(Xt, y, gram=gram)
+    else:
+        clf.fit(Xt, y)
+    return pipe, warm_started
+
+
+def _fit_fold(pipeline, X, y, classes, train_index, test_index, init=None, gram=None):
+    t0 = time.perf_counter()
+    gram_train = gram[np.ix_(train_index, train_index)] if gram is not None else None
+    pipe, warm_started = _fit_pipeline(pipeline, X[train_index], y[train_index], init, gram_train)
+    t1 = time.perf_counter()
+    proba_fold = pipe.predict_proba(X[test_index])
+    t2 = time.perf_counter()
+
+    # columns of pipe.classes_ -> columns of all classes (a class missing from the training runs gets probability 0)
+    proba = np.zeros((len(test_index), len(classes)))
+    proba[:, np.searchsorted(classes, pipe.classes_)] = proba_fold
+    y_pred = pipe.classes_[np.argmax(proba_fold, axis=1)]
+    clf    = pipe.steps[-1][1]
+    clf    = getattr(clf, 'estimator_', clf) # solver of a DualClassifier
+    n_iter = getattr(clf, 'n_iter_', None) # None for direct solvers (RidgeClassifier)
+    n_iter = int(np.max(n_iter)) if n_iter is not None else 0
+    return {
+        'pipe':         pipe,
+        'proba':        proba,
+        'accuracy':     np.mean(y_pred == y[test_index]),
+        'confusion':    confusion_matrix(y[test_index], y_pred, labels=classes),
+        'fit_time':     t1 - t0,
+        'score_time':   t2 - t1,
+        'n_iter':       n_iter,
+        'converged':    n_iter < (getattr(clf, 'max_iter', None) or np.inf),
+        'warm_started': warm_started,
+    }
+
+
+def logo_cv(pipeline, X, y, groups, n_jobs=1, warm_start=None, blas_threads=1):
+    """
+    Leave-one-group-out CV with one fit per fold; returns a dict with folds, proba, confusion, classes and coefs.
+
+    warm_start: None or the logo_cv result of the same samples/groups at a neighbouring HRF peak (see the module
+    header). Folds run on n_jobs threads with blas_threads BLAS threads each.
+    """
+    X       = np.asarray(X)
+    y       = np.asarray(y)
+    groups  = np.asarray(groups)
+    classes = np.unique(y)
+    splits  = list(LeaveOneGroupOut().split(X, y, groups))
+
+    inits = [None] * len(splits)
+    if warm_start is not None:
+        if not np.array_equal(warm_start['folds']['fold'].to_numpy(), [groups[test_index][0] for _, test_index in splits]):
+            raise ValueError("warm_start comes from different LOGO folds")
+        inits = warm_start['coefs']
+
+    gram = gram_matrix(X) if reuses_gram(pipeline) else None # all BLAS threads, once per decoder
+    with threadpool_limits(limits=blas_threads, user_api='blas'):
+        fits = Parallel(n_jobs=n_jobs, prefer='threads')(
+            delayed(_fit_fold)(pipeline, X, y, classes, train_index, test_index, init, gram)
+            for (train_index, test_index), init in zip(splits, inits)
+        )
+
+    proba = np.full((len(y), len(classes)), np.nan)
+    rows  = []
+    for (train_index, test_index), fit in zip(splits, fits):
+        proba[test_index] = fit['proba']
+        rows.append({
+            'fold':         groups[test_index][0],
+            'accuracy':     fit['accuracy'],
+            'n_train':      len(train_index),
+            'n_test':       len(test_index),
+            'fit_time':     fit['fit_time'],
+            'score_time':   fit['score_time'],
+            'n_iter':       fit['n_iter'],
+            'converged':    fit['converged'],
+            'warm_started': fit['warm_started'],
+        })
+    return {
+        'folds':     pd.DataFrame(rows),
+        'proba':     proba,
+        'confusion': np.stack([fit['confusion'] for fit in fits]),
+        'classes':   classes,
+        'coefs':     [_full_space_coef(fit['pipe'], X.shape[1]) for fit in fits], # warm start of the next HRF peak
+    }
+
+
+def check_cv_equivalence(pipeline, X, y, groups, cv_result, atol=1e-12):
+    """Fold accuracies of sklearn's cross_validate on the same pipeline; raises RuntimeError if they differ from cv_result."""
+    test_score = cross_validate(pipeline, X=X, y=y, groups=groups, cv=LeaveOneGroupOut(), scoring="accuracy")["test_score"]
+    if not np.allclose(test_score, cv_result['folds']['accuracy'].to_numpy(), rtol=0, atol=atol):
+        raise RuntimeError(
+            f"LOGO engine and cross_validate disagree: {cv_result['folds']['accuracy'].to_numpy()} vs. {test_score}"
+        )
+    return test_score
+
+
+def check_precision_drift(pipeline, X, y, groups, cv_result, atol=0.01):
+    """Mean LOGO accuracy on float64 X; raises RuntimeError if it differs from cv_result (float32 X) by more than atol."""
+    accuracy_64 = logo_cv(pipeline, np.asarray(X, dtype=np.float64), y, groups)['folds']['accuracy'].mean()
+    accuracy    = cv_result['folds']['accuracy'].mean()
+    if abs(accuracy_64 - accuracy) > atol:
+        raise RuntimeError(
+            f"decoding accuracy drifts with the feature dtype: {accuracy} ({np.asarray(X).dtype}) vs. {accuracy_64} (float64)"
+        )
+    return accuracy_64
+
+
+def save_cv_result(cv_result, save_prefix):
+    """Write <save_prefix>-cv_folds.csv (one row per fold) and <save_prefix>-cv_details.npz (proba, confusion, classes)."""
+    cv_result['folds'].to_csv(save_prefix + '-cv_folds.csv', index=False)
+    np.savez_compressed(
+        save_prefix + '-cv_details.npz',
+        proba=cv_result['proba'], confusion=cv_result['confusion'], classes=cv_result['classes'].astype(str),
+        folds=cv_result['folds']['fold'].to_numpy(),
+    )
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Input tracking: recompute only the outputs whose inputs or parameters changed
+# ========================================================================================================================================================
+# The analyses form a chain: fMRIPrep outputs -> ROI masks -> events TSVs -> GLM t-maps / decoding / RSA / cross-correlation.
+# Every unit of work records the sha1 of each input file it read together with the hash of its parameters
+# (smoothing_fwhm, confound_vars, T, space, TRword, HRF_peak, ...); a unit is stale, and recomputed, when any of them
+# differs from what was recorded:
+#   - subject loops (*_ROILoop_HPC.py): Checkpoint.wrap(..., inputs_fn=...) keeps the inputs digest of every finished
+#     (subject, ROI, HRF peak) unit in the manifest (AgingReplay_Checkpoint.py)
+#   - single outputs (GLM t-maps): is_stale() / record_inputs() with a <output>.deps.json sidecar
+# Changing one ROI mask or one subject's events thus re-runs that subject (and ROI) only.
+#
+# File digests are content hashes, cached per file under <digest_root>/ together with the size and mtime they were
+# computed for, so an unchanged file is hashed once and then only stat'ed. A missing input has digest None (the unit is
+# stale and fails in its own code with the usual error).
+# ========================================================================================================================================================
+
+import os
+import json
+import hashlib
+
+from AgingReplay_Checkpoint import param_hash
+from AgingReplay_FeatureCache import localizer_run_files, roi_mask_files, smt_tr_file
+from AgingReplay_EventIndex import event_file
+
+
+def _sha1_file(path, chunk_size=1 << 22):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_digest(path, digest_root=None):
+    """sha1 of the file content (None if it does not exist); cached under digest_root by (size, mtime)."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if digest_root is None:
+        return _sha1_file(path)
+
+    stat_key   = [st.st_size, st.st_mtime_ns]
+    cache_file = os.path.join(digest_root, hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:20] + '.json')
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if cached['stat'] == stat_key:
+            return cached['sha1']
+    digest = _sha1_file(path)
+    os.makedirs(digest_root, exist_ok=True)
+    with open(cache_file + '.tmp', 'w') as f:
+        json.dump({'path': os.path.abspath(path), 'stat': stat_key, 'sha1': digest}, f)
+    os.replace(cache_file + '.tmp', cache_file)
+    return digest
+
+
+def input_digests(paths, digest_root=None):
+    """{path: digest} of a list of input files."""
+    return {path: file_digest(path, digest_root) for path in paths}
+
+
+def inputs_digest(paths, digest_root=None):
+    """One short hash of all input files (order-independent)."""
+    return param_hash(input_digests(paths, digest_root))
+
+
+# ------ Input files of one subject ------
+def localizer_input_files(sub, ROI_name, space, T, maskSource, fMRI_predata_path, fMRI_preRes_path, path_ROI,
+                          sesName='ses-locTask', datatype='func'):
+    """ROI masks, preprocessed runs, confounds and events TSVs read by the localizer scripts for one subject (SubjectInfo)."""
+    func_path = fMRI_predata_path + '/' + sub.subID_num + '/' + 'output/' + sub.subID_num + '/' + sesName + '/' + datatype + '/'
+    files = roi_mask_files(sub.subID_num, ROI_name, sub.nBlock_SMT, sub.nBlock, space, T, path_ROI, maskSource, func_path)
+    event_path = fMRI_preRes_path + '/ses-locTask-events/' + sub.subID_num + '_' + sub.subID_str + '/'
+    for iBlc in range(0, sub.nBlock):
+        files.extend(localizer_run_files(func_path, sub.subID_num, sesName, iBlc))
+        files.append(event_file(event_path, sub.event_word, iBlc))
+    return files
+
+
+def smt_input_files(sub, ROI_name, space, T, TRword, nTRanal, fMRI_preRes_path):
+    """Per-TR SMT data files (smt_tr_file) read by the SeqAnal and cross-correlation scripts for one subject."""
+    smtDatas_saveDir = os.path.join(fMRI_preRes_path, 'smtData-folder', sub.subID_num + '_' + sub.subID_str, 'onlineReplay')
+    if TRword == 'averageTwo':
+        smtDatas_saveDir = os.path.join(smtDatas_saveDir, TRword)
+    return [smt_tr_file(smtDatas_saveDir, sub.subID_num, sub.subID_str, ROI_name, space, T, i_tr) for i_tr in range(0, nTRanal)]
+
+
+def behavior_file(sub, path_behv):
+    """Behavioral csv of the SeqMemTask session."""
+    return os.path.join(path_behv, 'data/' + sub.smtData_csv)
+
+
+# ------ Sidecar of a single output ------
+def deps_file(output):
+    return output + '.deps.json'
+
+
+def record_inputs(outputs, inputs, params, digest_root=None):
+    """Write <outputs[0]>.deps.json: the parameter hash, the digest of every input and the list of outputs."""
+    record = {'params': param_hash(params), 'inputs': input_digests(inputs, digest_root), 'outputs': list(outputs)}
+    with open(deps_file(outputs[0]) + '.tmp', 'w') as f:
+        json.dump(record, f, indent=1)
+    os.replace(deps_file(outputs[0]) + '.tmp', deps_file(outputs[0]))
+
+
+def stale_reasons(outputs, inputs, params, digest_root=None):
+    """Why the outputs have to be recomputed (empty list: up to date)."""
+    missing = [output for output in outputs if not os.path.exists(output)]
+    if missing:
+        return [f"missing output {output}" for output in missing]
+    if not os.path.exists(deps_file(outputs[0])):
+        return ["no record of the inputs"]
+    with open(deps_file(outputs[0])) as f:
+        record = json.load(f)
+    reasons = []
+    if record['params'] != param_hash(params):
+        reasons.append("parameters changed")
+    digests = input_digests(inputs, digest_root)
+    for path, digest in digests.items():
+        if record['inputs'].get(path) != digest or digest is None:
+            reasons.append(f"input changed: {path}")
+    reasons.extend(f"input dropped: {path}" for path in record['inputs'] if path not in digests)
+    return reasons
+
+
+def is_stale(outputs, inputs, params, digest_root=None):
+    """True if an output is missing or an input/parameter differs from the record; prints the reasons."""
+    reasons = stale_reasons(outputs, inputs, params, digest_root)
+    for reason in reasons:
+        print(f"[DEPS] {os.path.basename(outputs[0])}: {reason}")
+    return len(reasons) > 0
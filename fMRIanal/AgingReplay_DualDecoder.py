@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Sample-space (dual) fitting of the linear localizer decoders for wide ROIs
+# ========================================================================================================================================================
+# The localizer has at most ~450 samples per domain but up to tens of thousands of voxels. An l2-penalized linear decoder
+# only depends on the data through the Gram matrix K = X X^T (n_samples x n_samples): with K = U S U^T, the features
+# Z = U sqrt(S) (n_samples x rank) give the same inner products as X, so the estimator fitted on Z reaches the same
+# optimum as on X (up to the solver tolerance), and its weights map back to voxel space as W = (V S^-1/2 U^T) X.
+#
+#   fit_dual(estimator, X, y, gram=None) - a fitted clone of the estimator with coef_ in voxel space (a plain
+#                                          LogisticRegression / RidgeClassifier; predict_proba etc. work as usual)
+#   DualClassifier(estimator)            - the same as an estimator / pipeline step; logo_cv() computes K once per
+#                                          decoder and passes K[train][:, train] to every fold when no step before it
+#                                          changes X
+#
+# Solver cost per fit scales with n_samples instead of n_voxels; only K (n_samples^2 x n_voxels, one BLAS call) and the
+# back-projection of the weights touch the voxels. RidgeClassifier has no predict_proba; DualClassifier then returns the
+# softmax of the decision values (class scores, not calibrated probabilities).
+# ========================================================================================================================================================
+
+import numpy as np
+from scipy.special import softmax
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
+
+
+def gram_matrix(X, block_size=4096):
+    """X X^T accumulated in float64 over blocks of voxels, without a float64 copy of all of X (X may be float32)."""
+    X = np.asarray(X)
+    if X.dtype == np.float64:
+        return X @ X.T
+    gram = np.zeros((X.shape[0], X.shape[0]))
+    for j in range(0, X.shape[1], block_size):
+        X_block = X[:, j : j + block_size].astype(np.float64)
+        gram += X_block @ X_block.T
+    return gram
+
+
+def gram_features(gram):
+    """(Z, P) with Z = U sqrt(S) and P = U S^-1/2 over the non-null eigenvalues of the Gram matrix (Z = gram @ P)."""
+    S, U = np.linalg.eigh(gram)
+    keep = S > S.max() * len(S) * np.finfo(np.float64).eps
+    S, U = S[keep], U[:, keep]
+    return U * np.sqrt(S), U / np.sqrt(S)
+
+
+def fit_dual(estimator, X, y, gram=None):
+    """Fit a clone of a linear estimator in sample space; returns it with coef_ in the space of the columns of X."""
+    X = np.asarray(X)
+    if gram is None:
+        gram = gram_matrix(X)
+    Z, P = gram_features(gram)
+    est = clone(estimator).fit(Z, y)
+    est.coef_ = (est.coef_ @ P.T) @ X # (n_classes, rank) -> (n_classes, n_samples) -> (n_classes, n_voxels)
+    est.n_features_in_ = X.shape[1]
+    return est
+
+
+class DualClassifier(ClassifierMixin, BaseEstimator):
+    """Pipeline step that fits the wrapped linear estimator in sample space (see fit_dual)."""
+
+    def __init__(self, estimator=None):
+        self.estimator = estimator
+
+    def fit(self, X, y, gram=None):
+        self.estimator_ = fit_dual(self.estimator, X, y, gram)
+        self.classes_   = self.estimator_.classes_
+        return self
+
+    @property
+    def coef_(self):
+        return self.estimator_.coef_
+
+    @coef_.setter
+    def coef_(self, coef):
+        self.estimator_.coef_ = coef # e.g. z-scored weights (SeqAnal)
+
+    @property
+    def intercept_(self):
+        return self.estimator_.intercept_
+
+    def decision_function(self, X):
+        return self.estimator_.decision_function(X)
+
+    def predict(self, X):
+        return self.estimator_.predict(X)
+
+    def predict_proba(self, X):
+        if hasattr(self.estimator_, 'predict_proba'):
+            return self.estimator_.predict_proba(X)
+        return softmax(self.decision_function(X), axis=1)
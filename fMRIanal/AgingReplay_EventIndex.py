@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Event index of the localizer runs
+# ========================================================================================================================================================
+# The events-<event_word>-block<iBlc>.tsv files of a subject are parsed once into one structured array (one row per
+# content/position event, in file order):
+#   cond   - index into conditions_con (domain 0) or conditions_pos (domain 1)
+#   domain - 0: content, 1: position
+#   run    - localizer block (0-based)
+#   onset  - onset time in s
+# Events of other trial types (fixation, response, ...) are dropped.
+#
+# scan_idx() turns onset + HRF_peak into TR indices for both TRword modes with np.searchsorted, for one HRF peak or for
+# several at once, and sample_events() reads the corresponding rows of a run's (n_scans x n_voxels) time series:
+#   'nearestOne' - the TR closest to onset + HRF_peak (the earlier one on a tie, as np.argmin)
+#   'averageTwo' - the average of the last TR at or before onset + HRF_peak and the next TR (the last TR twice at the end)
+# ========================================================================================================================================================
+
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+DOMAIN_CON = 0
+DOMAIN_POS = 1
+
+event_dtype = np.dtype([('cond', np.int8), ('domain', np.int8), ('run', np.int16), ('onset', np.float64)])
+
+
+def event_file(event_path, event_word, iBlc):
+    return os.path.join(event_path, f"events-{event_word}-block{iBlc}.tsv")
+
+
+# per process: reused across HRF / ROI iterations only when the subjects run in the main process (SUBJECT_WORKERS=1);
+# run_subjects() forks a fresh pool per iteration, so pooled workers re-read the (small) TSVs every iteration
+@lru_cache(maxsize=8)
+def _load_event_index(event_path, event_word, nBlock, conditions_con, conditions_pos):
+    runs = []
+    for iBlc in range(0, nBlock):
+        events = pd.read_csv(event_file(event_path, event_word, iBlc), delimiter='\t')
+        trial_type = events['trial_type'].to_numpy()
+        cond_con = pd.Index(conditions_con).get_indexer(trial_type)
+        cond_pos = pd.Index(conditions_pos).get_indexer(trial_type)
+        keep = (cond_con >= 0) | (cond_pos >= 0)
+
+        run_index = np.zeros(np.count_nonzero(keep), dtype=event_dtype)
+        run_index['domain'] = np.where(cond_con[keep] >= 0, DOMAIN_CON, DOMAIN_POS)
+        run_index['cond']   = np.where(cond_con[keep] >= 0, cond_con[keep], cond_pos[keep])
+        run_index['run']    = iBlc
+        run_index['onset']  = events['onset'].to_numpy()[keep]
+        runs.append(run_index)
+    event_index = np.concatenate(runs)
+    event_index.flags.writeable = False # shared by every caller of the cache
+    return event_index
+
+
+def load_event_index(event_path, event_word, nBlock, conditions_con, conditions_pos):
+    """Structured array (cond, domain, run, onset) of all content and position events of a subject's localizer runs."""
+    return _load_event_index(event_path, event_word, nBlock, tuple(conditions_con), tuple(conditions_pos))
+
+
+def select_events(event_index, domain, run=None):
+    """Rows of one domain (and one run), in file order."""
+    keep = event_index['domain'] == domain
+    if run is not None:
+        keep &= event_index['run'] == run
+    return event_index[keep]
+
+
+def event_labels(events, conditions):
+    """Condition names of the rows of an event index."""
+    return np.asarray(conditions)[events['cond']].tolist()
+
+
+def scan_idx(onsets, n_scans, t_r, HRF_peak, TRword):
+    """
+    TR indices of onsets + HRF_peak, shape (..., n_events, 2) with the leading axes of HRF_peak (none for a scalar).
+
+    Both columns are the same TR for 'nearestOne'; for 'averageTwo' they are the two TRs to average.
+    """
+    frame_times = np.arange(n_scans) * t_r
+    peak_times  = np.asarray(HRF_peak, dtype=np.float64)[..., None] + np.asarray(onsets, dtype=np.float64)
+    if TRword == 'nearestOne':
+        right = np.clip(np.searchsorted(frame_times, peak_times, side='left'), 1, n_scans - 1)
+        left  = right - 1
+        if n_scans == 1:
+            nearest = np.zeros_like(right)
+        else:
+            # ties go to the earlier TR, as np.argmin(np.abs(peak_time - frame_times))
+            nearest = np.where(np.abs(peak_times - frame_times[left]) <= np.abs(peak_times - frame_times[right]), left, right)
+        return np.stack([nearest, nearest], axis=-1)
+    elif TRword == 'averageTwo':
+        n_before = np.searchsorted(frame_times, peak_times, side='right') # TRs at or before the peak time
+        return np.stack([n_before - 1, np.where(n_before < n_scans, n_before, n_before - 1)], axis=-1)
+    raise ValueError(f"unknown TRword: {TRword}")
+
+
+def sample_events(masked_data_clean, idx, TRword):
+    """Rows of a (n_scans, n_voxels) time series at the TR indices from scan_idx(), shape (..., n_events, n_voxels)."""
+    if TRword == 'nearestOne':
+        return masked_data_clean[idx[..., 0], :]
+    return np.mean(masked_data_clean[idx, :], axis=-2).astype(masked_data_clean.dtype) # keeps feature_dtype
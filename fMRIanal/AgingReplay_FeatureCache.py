@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Feature cache: cleaned, masked localizer time series
+# ========================================================================================================================================================
+# Write by XR @ Oct 18 2026
+# ========================================================================================================================================================
+# The localizer decoding, RSA and SeqAnal scripts all turn the same desc-preproc_bold runs into (n_scans x n_voxels)
+# matrices with NiftiMasker + signal.clean, and the first two do it again for every HRF peak. This module keeps one copy
+# of those matrices on disk per subject and ROI:
+#   <cache_root>/<subID_num>_<subID_str>/<ROI_name>/<key>/run-0<iBlc+1>.npy
+# where <key> is a hash of the intersected mask, smoothing_fwhm, confound_vars, tr_start, the signal.clean parameters and
+# the size/mtime of every run's preprocessed BOLD image and confounds TSV. Any change of these parameters, or a re-run
+# of fMRIPrep, gives a new key, so an old cache entry is never read with the wrong settings or inputs.
+#
+# Precision: the masked time series and SMT tensors are stored and handed to the scripts as feature_dtype (environment
+# variable FEATURE_DTYPE, float32 by default; the BOLD runs are float32 to begin with). Sums over samples or voxels
+# (signal.clean, Gram matrices, reliabilities, correlations) are accumulated in float64 by the code that computes them.
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import nibabel as nib
+
+from nilearn import signal
+from nilearn.image import smooth_img
+from nilearn.maskers import NiftiMasker
+from nilearn.masking import intersect_masks
+
+
+CACHE_VERSION = 1
+
+# dtype of the cached / returned feature matrices (see the module header)
+feature_dtype = np.dtype(os.environ.get('FEATURE_DTYPE', 'float32'))
+
+# signal.clean parameters used by all localizer scripts
+default_clean_kwargs = {
+    'detrend': True,
+    'standardize': 'zscore_sample',
+}
+
+
+# ------ Keys ------
+def mask_hash(mask_img):
+    """sha1 of the in-mask voxels, the shape and the affine of a 3D mask image."""
+    mask_data = np.asarray(mask_img.dataobj) != 0
+    h = hashlib.sha1()
+    h.update(np.asarray(mask_data.shape, dtype=np.int64).tobytes())
+    h.update(np.packbits(mask_data.ravel()).tobytes())
+    h.update(np.round(np.asarray(mask_img.affine, dtype=np.float64), 6).tobytes())
+    return h.hexdigest()
+
+
+def _file_stats(paths):
+    """[name, size, mtime_ns] of every file (size and mtime None if it does not exist)."""
+    stats = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stats.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+        except FileNotFoundError:
+            stats.append([os.path.basename(path), None, None])
+    return stats
+
+
+def cache_key(mask_img, smoothing_fwhm, confound_vars, tr_start, t_r, clean_kwargs=None, masker_standardize=True,
+              input_files=()):
+    """
+    Return (key, payload): key is a short hash of every parameter that changes the cleaned matrices.
+
+    input_files: the BOLD images and confounds TSVs the matrices are computed from (their size/mtime enter the key).
+    """
+    if clean_kwargs is None:
+        clean_kwargs = default_clean_kwargs
+    payload = {
+        'version': CACHE_VERSION,
+        'mask': mask_hash(mask_img),
+        'smoothing_fwhm': None if smoothing_fwhm is None else float(smoothing_fwhm),
+        'masker_standardize': masker_standardize,
+        'confound_vars': list(confound_vars),
+        'tr_start': int(tr_start),
+        't_r': float(t_r),
+        'clean': {k: clean_kwargs[k] for k in sorted(clean_kwargs)},
+        'dtype': feature_dtype.name,
+        'files': _file_stats(input_files),
+    }
+    key = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return key, payload
+
+
+def cache_dir(cache_root, subID_num, subID_str, ROI_name, key):
+    return os.path.join(cache_root, f"{subID_num}_{subID_str}", ROI_name, key)
+
+
+def _save_npy_atomic(path, arr):
+    # write to a temporary file first so that a killed job never leaves a truncated .npy behind
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, arr)
+    os.replace(tmp_path, path)
+
+
+# ------ File names of one localizer run ------
+def localizer_run_files(func_path, subID_num, sesName, iBlc, bold_space='T1w'):
+    """Return (func_file, confound_file) of localizer run iBlc (0-based)."""
+    func_fname     = f"{subID_num}_{sesName}_task-localizer_run-0{iBlc+1}_space-{bold_space}_desc-preproc_bold.nii.gz"
+    confound_fname = f"{subID_num}_{sesName}_task-localizer_run-0{iBlc+1}_desc-confounds_timeseries.tsv"
+    return os.path.join(func_path, func_fname), os.path.join(func_path, confound_fname)
+
+
+def localizer_input_runs(func_path, subID_num, sesName, nBlock):
+    """BOLD images and confounds TSVs of all localizer runs, in run order (the inputs of cache_key)."""
+    return [path for iBlc in range(0, nBlock) for path in localizer_run_files(func_path, subID_num, sesName, iBlc)]
+
+
+# ------ Mask + clean one run ------
+def _read_confounds(confound_file, tr_start, confound_vars):
+    print(f"Read the confound_timeseries: {confound_file}")
+    confound_df      = pd.read_csv(confound_file, delimiter='\t')
+    confound_df_used = confound_df.iloc[tr_start:]
+    return confound_df_used[confound_vars].values
+
+
+# ------ Lazily sliced runs ------
+class DroppedScansProxy:
+    """
+    Array proxy of a 4D run without its first tr_start scans.
+
+    Only the shape is known up front (from the header); the kept scans are read, in their stored dtype, when the
+    masker / smooth_img asks for the data, so no float64 copy of the run is made just to count or drop scans.
+    """
+    is_proxy = True
+
+    def __init__(self, dataobj, tr_start):
+        self.dataobj  = dataobj
+        self.tr_start = tr_start
+
+    @property
+    def shape(self):
+        return self.dataobj.shape[:-1] + (self.dataobj.shape[-1] - self.tr_start,)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.dataobj.dtype
+
+    # scaling of the NIfTI file, applied on read (nilearn picks the output dtype from it)
+    @property
+    def slope(self):
+        return self.dataobj.slope
+
+    @property
+    def inter(self):
+        return self.dataobj.inter
+
+    def __array__(self, dtype=None, copy=None):
+        data = np.asanyarray(self.dataobj[..., self.tr_start:]) # ArrayProxy reads only the kept volumes
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, slicer):
+        return np.asanyarray(self)[slicer]
+
+
+def load_run_img(func_file, tr_start):
+    """4D run without its first tr_start scans (lazy, see DroppedScansProxy); n_scans is img.shape[-1]."""
+    fun_img = nib.load(func_file)
+    return nib.Nifti1Image(DroppedScansProxy(fun_img.dataobj, tr_start), fun_img.affine, fun_img.header)
+
+
+def _clean(masked_data, confounds_matrix, t_r, clean_kwargs=None):
+    if clean_kwargs is None:
+        clean_kwargs = default_clean_kwargs
+    # detrending / confound regression in float64, stored as feature_dtype
+    masked_data_clean = signal.clean(signals=np.asarray(masked_data, dtype=np.float64),
+                                     t_r=t_r,
+                                     confounds=confounds_matrix,
+                                     **clean_kwargs)
+    return masked_data_clean.astype(feature_dtype, copy=False)
+
+
+def clean_localizer_run(func_file, confound_file, masker, tr_start, t_r, confound_vars, clean_kwargs=None):
+    """Mask, smooth and clean one localizer run; returns (n_scans, n_voxels)."""
+    print(f"functional nifti image (4D) is at: {func_file}")
+    # Remove the first TRs from the BOLD signal (read when the masker loads the run)
+    fun_img_used = load_run_img(func_file, tr_start)
+
+    # ----------Maker the functional data----------
+    masked_data = masker.fit_transform(fun_img_used) # shape=(n_timepoints or n_scans, n_voxels)
+    confounds_matrix = _read_confounds(confound_file, tr_start, confound_vars)
+    return _clean(masked_data, confounds_matrix, t_r, clean_kwargs)
+
+
+def _write_meta(save_dir, payload, runs):
+    payload = dict(payload)
+    payload['n_scans']  = [int(np.shape(r)[0]) for r in runs]
+    payload['n_voxels'] = int(np.shape(runs[0])[1]) if len(runs) > 0 else 0
+    with open(os.path.join(save_dir, 'meta.json'), 'w') as f:
+        json.dump(payload, f, indent=2, default=str)
+
+
+# ------ Cached access for all runs of one subject/ROI ------
+def load_localizer_clean_runs(subID_num, subID_str, ROI_name, mask_img, nBlock, tr_start,
+                              func_path, sesName, smoothing_fwhm, confound_vars, t_r, cache_root,
+                              clean_kwargs=None, masker_standardize=True, overwrite=False, mmap_mode=None):
+    """
+    Return a list with one cleaned (n_scans, n_voxels) matrix per localizer run.
+
+    Runs that are already in the cache are read from disk; missing runs are computed with
+    NiftiMasker + signal.clean (exactly as in the analysis scripts) and written to the cache.
+    """
+    key, payload = cache_key(mask_img, smoothing_fwhm, confound_vars, tr_start, t_r,
+                             clean_kwargs, masker_standardize, localizer_input_runs(func_path, subID_num, sesName, nBlock))
+    save_dir = cache_dir(cache_root, subID_num, subID_str, ROI_name, key)
+    os.makedirs(save_dir, exist_ok=True)
+
+    masker = None
+    runs   = []
+    for iBlc in range(0, nBlock):
+        run_file = os.path.join(save_dir, f"run-0{iBlc+1}.npy")
+        if os.path.exists(run_file) and not overwrite:
+            runs.append(np.load(run_file, mmap_mode=mmap_mode))
+            continue
+
+        if masker is None:
+            masker = NiftiMasker(
+                mask_img=mask_img,
+                smoothing_fwhm=smoothing_fwhm,
+                standardize=masker_standardize
+            )
+        func_file, confound_file = localizer_run_files(func_path, subID_num, sesName, iBlc)
+        masked_data_clean = clean_localizer_run(func_file, confound_file, masker,
+                                                tr_start, t_r, confound_vars, clean_kwargs)
+        _save_npy_atomic(run_file, masked_data_clean)
+        runs.append(masked_data_clean)
+
+    if masker is not None or not os.path.exists(os.path.join(save_dir, 'meta.json')):
+        _write_meta(save_dir, payload, runs)
+    else:
+        print(f"[CACHE] {subID_num}-{subID_str} {ROI_name}: read {nBlock} cleaned runs from {save_dir}")
+    return runs
+
+
+# ------ Single-pass extraction for many ROIs ------
+def roi_mask_files(subID_num, ROI_name, nBlock_SMT, nBlock, space, T, path_ROI, maskSource='funcRunsAll', func_path=None):
+    """
+    ROI mask files that are intersected for one subject, as in the localizer scripts.
+
+    maskSource 'funcRunsAll': the SMT and the localizer run masks; 'funcRunsLoc': the localizer run masks, or the
+    fMRIPrep brain masks of the localizer runs (in func_path) for ROI_name 'wholeBrain'.
+    """
+    mask_files = []
+    if maskSource == 'funcRunsLoc' and ROI_name == 'wholeBrain':
+        sesName_loc = 'ses-locTask'
+        for iBlc in range(0, nBlock):
+            mask_fname = f"{subID_num}_{sesName_loc}_task-localizer_run-0{iBlc+1}_space-{space}_desc-brain_mask.nii.gz"
+            mask_files.append(os.path.join(func_path, mask_fname))
+        return mask_files
+    # ----------SeqMemTask----------
+    if maskSource == 'funcRunsAll':
+        sesName_SMT = 'ses-SeqMemTask'
+        for iBlc in range(0, nBlock_SMT):
+            mask_path  = f"{path_ROI}/output_mask_SMT/{subID_num}/{sesName_SMT}/ROIs"
+            mask_fname = f"{ROI_name}_{subID_num}_{sesName_SMT}_space-{space}_T-{int(T*100)}_run-0{iBlc+1}.nii"
+            mask_files.append(os.path.join(mask_path, mask_fname))
+    # ----------Localizer task----------
+    sesName_loc = 'ses-locTask'
+    for iBlc in range(0, nBlock):
+        mask_path  = f"{path_ROI}/{subID_num}/{sesName_loc}/ROIs"
+        mask_fname = f"{ROI_name}_{subID_num}_{sesName_loc}_space-{space}_T-{int(T*100)}_run-0{iBlc+1}.nii"
+        mask_files.append(os.path.join(mask_path, mask_fname))
+    return mask_files
+
+
+def roi_mask_intersect(subID_num, ROI_name, nBlock_SMT, nBlock, space, T, path_ROI, maskSource='funcRunsAll', func_path=None):
+    """Intersect the ROI masks of one subject (see roi_mask_files)."""
+    mask_files = roi_mask_files(subID_num, ROI_name, nBlock_SMT, nBlock, space, T, path_ROI, maskSource, func_path)
+    mask_images_blc = [nib.load(mask_file) for mask_file in mask_files]
+    # threshold=0.5 (default); the intersected mask should have the same shape and affine
+    return intersect_masks(mask_images_blc, threshold=0.5)
+
+
+# ------ Mask store: intersected ROI masks as voxel indices ------
+# <cache_root>/<subID_num>/<ROI_name>_<maskSource>_space-<space>_T-<T*100>.npz holds the shape, the affine and the flat
+# (C-order) indices of the in-mask voxels, plus the size/mtime of the source masks it was computed from. The image is
+# rebuilt exactly as intersect_masks returns it (int8, same affine), so NiftiMasker orders the voxels the same way.
+# per process: with SUBJECT_WORKERS=1 the HRF/ROI iterations of a script read each store file once; pooled workers are
+# forked fresh for every iteration (run_subjects) and read the small .npz store file again
+_mask_memo = {}
+
+def mask_store_file(cache_root, subID_num, ROI_name, maskSource, space, T):
+    return os.path.join(cache_root, subID_num, f"{ROI_name}_{maskSource}_space-{space}_T-{int(T*100)}.npz")
+
+
+def _mask_sources(mask_files):
+    sources = []
+    for mask_file in mask_files:
+        st = os.stat(mask_file)
+        sources.append([mask_file, st.st_size, st.st_mtime_ns])
+    return json.dumps(sources)
+
+
+def load_mask_intersect(subID_num, ROI_name, nBlock_SMT, nBlock, space, T, path_ROI, cache_root,
+                        maskSource='funcRunsAll', func_path=None):
+    """Intersected ROI mask of one subject (as roi_mask_intersect), read from the mask store while its sources are unchanged."""
+    mask_files = roi_mask_files(subID_num, ROI_name, nBlock_SMT, nBlock, space, T, path_ROI, maskSource, func_path)
+    sources    = _mask_sources(mask_files)
+    store_file = mask_store_file(cache_root, subID_num, ROI_name, maskSource, space, T)
+    if (store_file, sources) in _mask_memo:
+        return _mask_memo[(store_file, sources)]
+
+    stored = np.load(store_file) if os.path.exists(store_file) else None
+    if stored is not None and str(stored['sources']) == sources:
+        mask_data = np.zeros(tuple(stored['shape']), dtype=np.int8)
+        mask_data.flat[stored['voxel_idx']] = 1
+        mask_img  = nib.Nifti1Image(mask_data, stored['affine'])
+    else:
+        mask_img  = roi_mask_intersect(subID_num, ROI_name, nBlock_SMT, nBlock, space, T, path_ROI, maskSource, func_path)
+        mask_data = np.asarray(mask_img.dataobj)
+        os.makedirs(os.path.dirname(store_file), exist_ok=True)
+        tmp_file = store_file[:-len('.npz')] + '.tmp.npz'
+        np.savez(tmp_file, shape=np.asarray(mask_data.shape), affine=mask_img.affine,
+                 voxel_idx=np.flatnonzero(mask_data).astype(np.int32), sources=np.asarray(sources))
+        os.replace(tmp_file, store_file)
+        print(f"[MASK] {subID_num} {ROI_name}: intersected {len(mask_files)} masks -> {store_file}")
+    _mask_memo[(store_file, sources)] = mask_img
+    return mask_img
+
+
+def extract_localizer_runs_multiROI(subID_num, subID_str, roi_masks, nBlock, tr_start,
+                                    func_path, sesName, smoothing_fwhm, confound_vars, t_r, cache_root,
+                                    clean_kwargs=None, masker_standardize=True, overwrite=False):
+    """
+    Fill the feature cache for many ROIs at once.
+
+    roi_masks: list of (ROI_name, intersected mask image); the same ROI may appear with several masks
+    (e.g. different signal ratios T). Each run is loaded, smoothed and has its confounds read only once;
+    every mask is then applied to the smoothed volume. Smoothing acts on the full volume before masking
+    (as inside NiftiMasker), so the cached matrices are the same as those of load_localizer_clean_runs.
+    Returns the list of cache directories in the order of roi_masks.
+    """
+    entries = []
+    input_runs = localizer_input_runs(func_path, subID_num, sesName, nBlock)
+    for ROI_name, mask_img in roi_masks:
+        key, payload = cache_key(mask_img, smoothing_fwhm, confound_vars, tr_start, t_r,
+                                 clean_kwargs, masker_standardize, input_runs)
+        save_dir = cache_dir(cache_root, subID_num, subID_str, ROI_name, key)
+        os.makedirs(save_dir, exist_ok=True)
+        entries.append({
+            'dir': save_dir,
+            'payload': payload,
+            'masker': NiftiMasker(mask_img=mask_img, smoothing_fwhm=None, standardize=masker_standardize),
+        })
+
+    for iBlc in range(0, nBlock):
+        run_fname = f"run-0{iBlc+1}.npy"
+        todo = [e for e in entries if overwrite or not os.path.exists(os.path.join(e['dir'], run_fname))]
+        if len(todo) == 0:
+            continue
+
+        # ----------Load + smooth the run only once----------
+        func_file, confound_file = localizer_run_files(func_path, subID_num, sesName, iBlc)
+        print(f"functional nifti image (4D) is at: {func_file}")
+        fun_img_used = load_run_img(func_file, tr_start)
+        fun_img_smoothed = smooth_img(fun_img_used, fwhm=smoothing_fwhm)
+        confounds_matrix = _read_confounds(confound_file, tr_start, confound_vars)
+
+        # ----------Apply every ROI mask to the same smoothed run----------
+        for e in todo:
+            masked_data = e['masker'].fit_transform(fun_img_smoothed)
+            masked_data_clean = _clean(masked_data, confounds_matrix, t_r, clean_kwargs)
+            _save_npy_atomic(os.path.join(e['dir'], run_fname), masked_data_clean)
+        print(f"[EXTRACT] {subID_num}-{subID_str} run-0{iBlc+1}: {len(todo)} masks")
+        del fun_img_smoothed
+
+    for e in entries:
+        runs = [np.load(os.path.join(e['dir'], f"run-0{iBlc+1}.npy"), mmap_mode='r') for iBlc in range(0, nBlock)]
+        _write_meta(e['dir'], e['payload'], runs)
+    return [e['dir'] for e in entries]
+
+
+# ------ SMT data: 18 per-TR NIfTI files as one (trials x voxels x TRs) tensor ------
+def smt_tr_file(smtDatas_saveDir, subID_num, subID_str, ROI_name, space, T, i_tr):
+    return (smtDatas_saveDir + '/' + subID_num + '-' + subID_str + '-' + ROI_name + '_space-' + space
+            + '_signalT-' + str(int(T*100)) + '-TR' + str(i_tr) + "-nifti_data_smt.nii.gz")
+
+
+def load_smt_tensor(smtDatas_saveDir, subID_num, subID_str, ROI_name, space, T, nTRanal,
+                    mask_img, smoothing_fwhm, masker_standardize=False, dtype=feature_dtype, overwrite=False):
+    """
+    Return the masked SMT data of all TRs as one (nTrials, n_voxels, nTRanal) array.
+
+    The masker is fitted once and applied to each "-TR{i}-nifti_data_smt.nii.gz" file (standardize, if set,
+    still acts within each TR file, as before). The tensor is cached next to the per-TR files; the cache name
+    carries a hash of the mask, the masker settings and the size/mtime of the per-TR files, so rewriting
+    any of them triggers a rebuild.
+    """
+    tr_files = [smt_tr_file(smtDatas_saveDir, subID_num, subID_str, ROI_name, space, T, i_tr)
+                for i_tr in range(0, nTRanal)]
+    payload = {
+        'version': CACHE_VERSION,
+        'mask': mask_hash(mask_img),
+        'smoothing_fwhm': None if smoothing_fwhm is None else float(smoothing_fwhm),
+        'masker_standardize': masker_standardize,
+        'dtype': np.dtype(dtype).name,
+        'files': [(os.path.basename(f), os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in tr_files],
+    }
+    key = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    tensor_file = (smtDatas_saveDir + '/' + subID_num + '-' + subID_str + '-' + ROI_name + '_space-' + space
+                   + '_signalT-' + str(int(T*100)) + '-nTR' + str(nTRanal) + '-' + key + "-nifti_data_smt_masked.npy")
+    if os.path.exists(tensor_file) and not overwrite:
+        print(f"[CACHE] SMT tensor: {tensor_file}")
+        return np.load(tensor_file)
+
+    masker = NiftiMasker(
+        mask_img=mask_img,
+        smoothing_fwhm=smoothing_fwhm,
+        standardize=masker_standardize
+    ).fit()
+    tensor = None
+    for i_tr, smtData_filename in enumerate(tr_files):
+        nifti_data_smt = nib.load(smtData_filename) # X*Y*Z*nTrials
+        nifti_data_smt_masked = masker.transform(nifti_data_smt) # shape=(nTrials, n_voxels)
+        if tensor is None:
+            tensor = np.zeros(np.shape(nifti_data_smt_masked) + (nTRanal,), dtype=dtype)
+        tensor[:, :, i_tr] = nifti_data_smt_masked
+    _save_npy_atomic(tensor_file, tensor)
+    return tensor
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Permutation test of the LOGO decoding accuracy
+# ========================================================================================================================================================
+# The labels are shuffled within runs (every run keeps its set of labels) and the whole LOGO cross-validation is repeated
+# on every shuffle; the statistic is the mean accuracy over folds, as in scores_con_pos. The observed accuracy counts as
+# one draw of the null: p = (1 + #{null >= observed}) / (1 + n_perm).
+#
+# Batched path - the decoder is DualClassifier(RidgeClassifier) and no step before it changes X (--decoder dual-ridge
+# without --top-frac or standardization): the ridge fit is linear in the one-hot labels, so per fold the centred Gram
+# matrix is decomposed once, (K_c + alpha I)^-1 is formed once, and all permutations are solved and scored as one batch
+# of matrix products. Nothing in this path depends on the labels except that last product.
+#
+# Any other pipeline (lbfgs, label-dependent voxel selection) is refitted through logo_cv() for every permutation; exact,
+# but keep n_perm small.
+# ========================================================================================================================================================
+
+import numpy as np
+from sklearn.linear_model import RidgeClassifier
+from sklearn.model_selection import LeaveOneGroupOut
+from AgingReplay_DecodingCV import logo_cv, reuses_gram
+from AgingReplay_DualDecoder import gram_matrix
+
+
+def within_run_permutations(y, groups, n_perm, random_state=None):
+    """(n_perm, n_samples) label arrays, each a shuffle of y within every group (run)."""
+    y      = np.asarray(y)
+    groups = np.asarray(groups)
+    rng    = np.random.default_rng(random_state)
+    base   = np.argsort(groups, kind='stable') # samples grouped by run, in their original order
+    keys   = rng.random((n_perm, len(y)))
+    order  = np.lexsort((keys, np.broadcast_to(groups, keys.shape)), axis=-1) # grouped by run, random order within run
+    y_perm = np.empty((n_perm, len(y)), dtype=y.dtype)
+    y_perm[:, base] = y[order]
+    return y_perm
+
+
+def _batched_ridge(pipeline, X, y_perm, groups, classes):
+    """Mean LOGO accuracy of DualClassifier(RidgeClassifier) for every row of y_perm, shape (n_perm,)."""
+    alpha  = pipeline.steps[-1][1].estimator.alpha
+    gram   = gram_matrix(X)
+    onehot = (y_perm[..., None] == classes).astype(np.float64) # (n_perm, n_samples, n_classes)
+    fold_acc = []
+    for train_index, test_index in LeaveOneGroupOut().split(X, groups=groups):
+        K_tt = gram[np.ix_(train_index, train_index)]
+        K_et = gram[np.ix_(test_index, train_index)]
+        # Gram matrices of X centred on the training mean (fit_intercept=True)
+        r    = K_tt.mean(axis=0)
+        g    = r.mean()
+        K_tt = K_tt - r[None, :] - r[:, None] + g
+        K_et = K_et - K_et.mean(axis=1, keepdims=True) - r[None, :] + g
+        S, U = np.linalg.eigh(K_tt)
+        B    = (K_et @ U / (S + alpha)) @ U.T # test decision = B @ (Y_train - mean) + mean
+
+        Y_train = onehot[:, train_index, :]
+        Y_mean  = Y_train.mean(axis=1, keepdims=True)
+        decision = B @ (Y_train - Y_mean) + Y_mean # (n_perm, n_test, n_classes)
+        y_pred   = classes[np.argmax(decision, axis=-1)]
+        fold_acc.append(np.mean(y_pred == y_perm[:, test_index], axis=1))
+    return np.mean(fold_acc, axis=0)
+
+
+def can_batch(pipeline):
+    """True if logo_permutation_test() solves the permutations in one batch for this pipeline."""
+    clf = pipeline.steps[-1][1]
+    return (
+        reuses_gram(pipeline) and type(clf.estimator) is RidgeClassifier and clf.estimator.fit_intercept
+        and clf.estimator.class_weight is None
+    )
+
+
+def logo_permutation_test(pipeline, X, y, groups, n_perm, random_state=None, n_jobs=1, blas_threads=1):
+    """
+    Null distribution of the mean LOGO accuracy under within-run label shuffles.
+
+    Returns a dict with observed, null (n_perm,), p_value and batched. The observed accuracy comes from the same
+    code path as the null.
+    """
+    y       = np.asarray(y)
+    groups  = np.asarray(groups)
+    classes = np.unique(y)
+    y_perm  = within_run_permutations(y, groups, n_perm, random_state)
+
+    if can_batch(pipeline):
+        acc = _batched_ridge(pipeline, X, np.vstack([y[None, :], y_perm]), groups, classes)
+        observed, null = acc[0], acc[1:]
+    else:
+        observed = logo_cv(pipeline, X, y, groups, n_jobs=n_jobs, blas_threads=blas_threads)['folds']['accuracy'].mean()
+        null     = np.array([
+            logo_cv(pipeline, X, y_perm_i, groups, n_jobs=n_jobs, blas_threads=blas_threads)['folds']['accuracy'].mean()
+            for y_perm_i in y_perm
+        ])
+    return {
+        'observed': observed,
+        'null':     null,
+        'p_value':  (1 + np.count_nonzero(null >= observed)) / (1 + n_perm),
+        'batched':  can_batch(pipeline),
+    }
+
+
+def permutation_summary(perm_result, quantiles=(0.5, 0.95, 0.99)):
+    """One row (dict) per test: observed, p_value, n_perm, null_mean, null_q50/q95/q99, batched."""
+    row = {
+        'observed':  perm_result['observed'],
+        'p_value':   perm_result['p_value'],
+        'n_perm':    len(perm_result['null']),
+        'null_mean': np.mean(perm_result['null']),
+    }
+    for q in quantiles:
+        row[f"null_q{int(round(q*100))}"] = np.quantile(perm_result['null'], q)
+    row['batched'] = perm_result['batched']
+    return row
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Single-pass multi-ROI extraction of the localizer runs
+# ========================================================================================================================================================
+# Write by XR @ Oct 18 2026
+# ========================================================================================================================================================
+# One SLURM task per subject: every localizer run (desc-preproc_bold) is loaded and smoothed once, and all ROI masks
+# are applied to it in the same pass. The cleaned (n_scans x n_voxels) matrices go into the feature cache
+# (AgingReplay_FeatureCache.py), where the localizer decoding, SeqAnal and RSA scripts read them.
+#
+# Usage: python AgingReplay_ROIextract_multiROI.py --subj-idx 12 --rois VISventral VISlow MTL --smoothing-fwhm 2 6 --T 0 0.3
+
+import os
+import argparse
+
+from AgingReplay_FeatureCache import load_mask_intersect, extract_localizer_runs_multiROI
+from AgingReplay_SubjectRegistry import get_subject, resolve_subject
+
+
+# -----------------------
+# Paths
+# -----------------------
+fMRI_predata_path = '/home/mpib/ren/rxj-neurocode/AgingStudy/AgingStudy-fMRI-data/fMRI-PreprocessedData'
+fMRI_preRes_path  = '/home/mpib/ren/rxj-neurocode/AgingStudy/AgingStudy-fMRI-data/fMRI-PreprocessResult'
+path_ROI          = '/home/mpib/ren/rxj-neurocode/AgingStudy/AgingStudy-fMRI-data/Decoding/output_mask'
+
+# -----------------------
+# Parameters (the same as in the localizer scripts)
+# -----------------------
+sesName  = 'ses-locTask'
+datatype = 'func'
+t_r      = 2 # RepetitionTime = 2 s
+confound_vars = ['global_signal', 'framewise_displacement',
+                 'trans_x', 'trans_y', 'trans_z',
+                 'trans_x_derivative1', 'trans_y_derivative1', 'trans_z_derivative1',
+                 'rot_x', 'rot_y', 'rot_z',
+                 'rot_x_derivative1', 'rot_y_derivative1', 'rot_z_derivative1',
+                 'a_comp_cor_00','a_comp_cor_01', 'a_comp_cor_02', 'a_comp_cor_03','a_comp_cor_04', 'a_comp_cor_05']
+space = 'T1w'
+ROI_names_default = ['VISventral', 'VISlow', 'MTL', 'HPC', 'ERH', 'PFCdv', 'PFCdorsoL', 'PFCventroL', 'ventricles']
+
+featureCache_dir = os.path.join(fMRI_preRes_path, 'feature-cache', sesName)
+maskCache_dir    = os.path.join(fMRI_preRes_path, 'feature-cache', 'roi-masks') # intersected masks, read by the ROI-loop scripts
+
+
+def run_single_subject(subIdx, ROI_names, smoothing_fwhms, Ts, overwrite=False):
+    sub       = get_subject(subIdx) # run/condition settings, see AgingReplay_SubjectRegistry.py
+    subID_str = sub.subID_str
+    subID_num = sub.subID_num
+    print('++++++++++++++++++ subj: ' + subID_str + ' (' + subID_num + ') ++++++++++++++++++')
+
+    tr_start   = sub.tr_start # the stimuli will be displayed in the beginning of the 3rd (2) or 4th (3) TR
+    nBlock_SMT = sub.nBlock_SMT # blocks for the sequential memory task
+    nBlock     = sub.nBlock # blocks for the localizer task
+
+    func_path = os.path.join(fMRI_predata_path, subID_num, 'output', subID_num, sesName, datatype)
+
+    # ----------every (ROI, signal ratio) mask; the cache is keyed by the mask itself----------
+    roi_masks = []
+    for T in Ts:
+        for ROI_name in ROI_names:
+            roi_masks.append((ROI_name, load_mask_intersect(subID_num, ROI_name, nBlock_SMT, nBlock, space, T, path_ROI, maskCache_dir)))
+
+    # ----------one pass over the runs per smoothing kernel, shared by all masks----------
+    for smoothing_fwhm in smoothing_fwhms:
+        cache_dirs = extract_localizer_runs_multiROI(
+            subID_num, subID_str, roi_masks, nBlock, tr_start, func_path, sesName,
+            smoothing_fwhm, confound_vars, t_r, featureCache_dir, overwrite=overwrite
+        )
+        for (ROI_name, _), d in zip(roi_masks, cache_dirs):
+            print(f"[SAVE] fwhm={smoothing_fwhm} {ROI_name}: {d}")
+
+    print(f"==========ROI extraction completed for {subID_num}-{subID_str} ==========")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subj-idx", type=int, default=None, help="Index into subj_list/subj_ids (0-based).")
+    parser.add_argument("--subj-id", type=str, default=None, help="BIDS id like sub-03.")
+    parser.add_argument("--subj-code", type=str, default=None, help="Code like JI9FBD.")
+    parser.add_argument("--rois", nargs="+", default=ROI_names_default, help="ROI names to extract in one pass.")
+    parser.add_argument("--smoothing-fwhm", nargs="+", type=float, default=[2.0, 6.0], help="Smoothing kernels (mm).")
+    parser.add_argument("--T", nargs="+", type=float, default=[0.0, 0.3], help="Signal ratios of the ROI masks.")
+    parser.add_argument("--overwrite", action="store_true", help="Recompute cache entries that already exist.")
+    args = parser.parse_args()
+
+    subIdx, subID_str, subID_num = resolve_subject(args.subj_idx, args.subj_id, args.subj_code)
+    print(f"Running subject: subIdx={subIdx}, subID_num={subID_num}, subID_str={subID_str}")
+    run_single_subject(subIdx, args.rois, args.smoothing_fwhm, args.T, overwrite=args.overwrite)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Batched RSA of the localizer condition means: sequence RDMs and model regressions
+# ========================================================================================================================================================
+# The neural RDM of a sequence is the correlation distance between the mean patterns of its conditions, and the
+# correlation of two conditions does not depend on the sequence they appear in. So the condition means of a subject are
+# stacked into one (n_conditions, n_voxels) array, all pairwise correlations come from one normalised matrix product,
+# and every sequence's 5x5 RDM is an index into that matrix.
+#
+# Each neural RDM vector y (upper triangle) is regressed on its model RDM vector x, both z-scored across the pairs:
+# zy = b0 + beta * zx, least squares with an intercept. This is solved for all sequences at once: the (n_seq, n_pairs, 2)
+# design matrices [1, zx] go through one batched pseudo-inverse (the least-squares solution, also for a flat model vector).
+#
+# Model RDMs are looked up by their label tuple in a dict instead of a scan over the model list.
+#
+# Permutation test: a 5x5 RDM has only 10 cells, so the null distribution of the beta comes from relabelling the 5
+# positions of the model RDM (rows and columns permuted together): all 5! = 120 relabellings (exact test), or the
+# identity plus n_perm-1 random ones. The betas of all sequences x relabellings are one einsum of the z-scored neural
+# vectors with the z-scored permuted model vectors; p = fraction of relabellings (identity included) whose beta is at
+# least the observed one.
+#
+# Crossnobis RDMs (rdm_method='crossnobis' in the RSA script): condition means pooled over all runs carry the trial noise
+# into every distance, which biases them upward. Instead, the condition means are taken per run (run_condition_means),
+# and the distance of two conditions is the inner product of their difference in one run with their difference in
+# another run, averaged over all pairs of different runs - unbiased, 0 in expectation for two conditions with the same
+# pattern. The patterns are first noise-normalised with the residuals of the trials around their run-wise means:
+#   'shrinkage' - multivariate, Sigma = lam * diag(S) + (1-lam) * S, S the residual covariance; Sigma^-1 is applied through
+#                 the Woodbury identity with the (n_trials, n_trials) residual Gram matrix, never an (n_voxels, n_voxels) one
+#   'diag'      - univariate, every voxel divided by its residual standard deviation
+#   None        - no normalisation (cross-validated Euclidean distance)
+# The inner products of all (run, condition) x (run, condition) patterns are one matrix product, and the distances of
+# all run pairs and condition pairs one einsum over it; conditions missing in a run leave out the run pairs concerned.
+# Distances are per voxel.
+# ========================================================================================================================================================
+
+import itertools
+import numpy as np
+
+
+def condition_means(X, labels, conditions):
+    """(means, valid_labels): mean pattern (n_valid, n_voxels) of every condition that has trials, in the order of conditions."""
+    labels       = np.asarray(labels)
+    valid_labels = [c for c in conditions if np.any(labels == c)]
+    W = (labels[None, :] == np.asarray(valid_labels)[:, None]).astype(np.float64) # (n_valid, n_trials)
+    W /= W.sum(axis=1, keepdims=True)
+    return W @ X, valid_labels
+
+
+def pattern_similarity(means):
+    """(n_cond, n_cond) Pearson correlation of the condition means across voxels: r_ij = <m_i - mean(m_i), m_j - mean(m_j)> / norms."""
+    means = np.asarray(means, dtype=np.float64)
+    Z = means - means.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Z = Z / np.linalg.norm(Z, axis=1, keepdims=True)
+    return np.clip(Z @ Z.T, -1.0, 1.0) # as np.corrcoef
+
+
+def correlation_distance(means):
+    """(n_cond, n_cond) correlation distance 1 - r_ij of the condition means."""
+    return 1.0 - pattern_similarity(means)
+
+
+def run_condition_means(X, labels, runs, conditions):
+    """
+    (means, present, valid_labels, residuals): mean pattern of every condition in every run (n_runs, n_valid, n_voxels),
+    0 where the condition has no trials in the run, present (n_runs, n_valid) marking the others, and the residuals
+    (n_trials, n_voxels) of the trials around the mean of their run and condition (0 for trials of other conditions).
+    """
+    labels, runs = np.asarray(labels), np.asarray(runs)
+    valid_labels = [c for c in conditions if np.any(labels == c)]
+    run_ids      = np.unique(runs)
+    # one-hot (run, condition) of every trial: (n_runs, n_valid, n_trials)
+    W = (runs[None, None, :] == run_ids[:, None, None]) & (labels[None, None, :] == np.asarray(valid_labels)[None, :, None])
+    counts  = W.sum(axis=-1)
+    present = counts > 0
+    W = W / np.maximum(counts, 1)[..., None]
+    means = np.einsum('rct,tv->rcv', W, X, dtype=np.float64)
+    fitted    = np.einsum('rct,rcv->tv', W > 0, means)
+    residuals = np.where(np.any(W > 0, axis=(0, 1))[:, None], X - fitted, 0.0)
+    return means, present, valid_labels, residuals
+
+
+def _noise_inner_products(F, residuals, n_dof, noise='shrinkage', shrinkage=0.4):
+    """F Sigma^-1 F^T for the patterns F (n, n_voxels), Sigma the noise covariance of the residuals (see the header)."""
+    if noise is None:
+        return F @ F.T
+    var  = np.einsum('tv,tv->v', residuals, residuals) / n_dof
+    Dinv = np.where(var > 1e-12, 1.0 / np.where(var > 1e-12, var, 1.0), 0.0) # voxels without variance drop out
+    if noise == 'diag':
+        return (F * Dinv) @ F.T
+    if noise != 'shrinkage':
+        raise ValueError(f"noise must be 'shrinkage', 'diag' or None, got {noise!r}")
+    if not 0 < shrinkage <= 1:
+        raise ValueError(f"shrinkage must be in (0, 1], got {shrinkage}")
+    # Sigma = lam D + c E^T E  ->  Sigma^-1 = A - c A E^T (I + c E A E^T)^-1 E A,  A = D^-1 / lam,  c = (1-lam) / n_dof
+    c   = (1.0 - shrinkage) / n_dof
+    FA  = F * (Dinv / shrinkage)
+    EA  = residuals * (Dinv / shrinkage)
+    K   = np.eye(len(residuals)) + c * (EA @ residuals.T)
+    FAE = FA @ residuals.T
+    return FA @ F.T - c * FAE @ np.linalg.solve(K, FAE.T)
+
+
+def crossnobis_distance(X, labels, runs, conditions, noise='shrinkage', shrinkage=0.4):
+    """
+    (dist, valid_labels): crossnobis distance (n_valid, n_valid) of every pair of conditions with trials, averaged over
+    the pairs of different runs that have both conditions, per voxel; NaN for a pair that is never in two runs.
+
+    noise: 'shrinkage' (with the weight shrinkage of the diagonal), 'diag' or None, see the header.
+    """
+    means, present, valid_labels, residuals = run_condition_means(X, labels, runs, conditions)
+    n_runs, n_cond, n_vox = means.shape
+    n_dof = max(int(np.isin(np.asarray(labels), valid_labels).sum() - present.sum()), 1) # trials minus fitted means
+
+    G = _noise_inner_products(means.reshape(n_runs * n_cond, n_vox), residuals, n_dof, noise, shrinkage)
+    G = G.reshape(n_runs, n_cond, n_runs, n_cond).transpose(0, 2, 1, 3) # G[a, b, i, j] = <mean_i in run a, mean_j in run b>
+    g = np.einsum('abii->abi', G)
+    # <m_i^a - m_j^a, m_i^b - m_j^b> for every run pair (a, b) and condition pair (i, j)
+    d = g[:, :, :, None] + g[:, :, None, :] - G - G.transpose(0, 1, 3, 2)
+    w = np.einsum('ai,aj,bi,bj->abij', present, present, present, present).astype(np.float64)
+    w[np.arange(n_runs), np.arange(n_runs)] = 0.0 # only pairs of different runs
+    n_pairs = w.sum(axis=(0, 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dist = np.einsum('abij,abij->ij', w, d) / n_pairs / n_vox
+    dist[n_pairs == 0] = np.nan
+    dist[np.arange(n_cond), np.arange(n_cond)] = 0.0
+    return dist, valid_labels
+
+
+def sequence_rdms(distance, valid_labels, sequences):
+    """
+    (rdms, kept): RDMs (n_kept, L, L) of the sequences whose labels all have a pattern, taken from the distance matrix of
+    the valid conditions in the order of the conditions in each sequence, and the indices of those sequences.
+    """
+    label_idx = {lab: i for i, lab in enumerate(valid_labels)}
+    kept      = [i_seq for i_seq, seq in enumerate(sequences) if all(lab in label_idx for lab in seq)]
+    seq_idx   = np.array([[label_idx[lab] for lab in sequences[i_seq]] for i_seq in kept], dtype=int).reshape(len(kept), -1)
+    rdms = distance[seq_idx[:, :, None], seq_idx[:, None, :]].copy()
+    rdms[:, np.arange(seq_idx.shape[1]), np.arange(seq_idx.shape[1])] = 0.0
+    return rdms, kept
+
+
+def upper_tri(rdms, k=1):
+    """Upper triangles of a stack of RDMs, shape (..., n_pairs)."""
+    iu = np.triu_indices(rdms.shape[-1], k=k)
+    return rdms[..., iu[0], iu[1]]
+
+
+def _zscore_rows(V):
+    V = np.asarray(V, dtype=np.float64)
+    return (V - V.mean(axis=-1, keepdims=True)) / (V.std(axis=-1, keepdims=True) + 1e-12)
+
+
+def rdm_regression(neural_vecs, model_vecs):
+    """
+    Standardized beta, intercept and Pearson r of every neural RDM vector on its model vector, (n_seq,) each.
+
+    neural_vecs, model_vecs: (n_seq, n_pairs); model_vecs may also be one (n_pairs,) vector shared by all sequences.
+    """
+    zy = _zscore_rows(neural_vecs)
+    zx = np.broadcast_to(_zscore_rows(model_vecs), zy.shape)
+    design = np.stack([np.ones_like(zx), zx], axis=-1) # (n_seq, n_pairs, 2)
+    b = (np.linalg.pinv(design) @ zy[..., None])[..., 0] # one batched least-squares solve
+    # Pearson r of zy and zx: sum(a*c) / (|a| |c|) with a, c the centred vectors
+    a = zy - zy.mean(axis=-1, keepdims=True)
+    c = zx - zx.mean(axis=-1, keepdims=True)
+    corr = (a * c).sum(axis=-1) / (np.sqrt((a * a).sum(axis=-1)) * np.sqrt((c * c).sum(axis=-1)) + 1e-12)
+    return {'beta': b[:, 1], 'intercept': b[:, 0], 'corr': corr}
+
+
+def position_permutations(L, n_perm=None, random_state=None):
+    """(n, L) relabellings of the L sequence positions, the identity first: all L! if n_perm is None, else n_perm rows."""
+    if n_perm is None:
+        return np.array(list(itertools.permutations(range(L))), dtype=int) # lexicographic: the identity is first
+    rng = np.random.default_rng(random_state)
+    return np.vstack([np.arange(L)] + [rng.permutation(L) for _ in range(n_perm - 1)])
+
+
+def rdm_permutation_test(neural_vecs, model_rdms, perms):
+    """
+    Null betas (n_seq, n_perm) of every neural RDM vector under the relabellings perms (identity first) of its model
+    RDM (n_seq, L, L), and the p-values (n_seq,) of the observed (identity) betas.
+    """
+    zy = _zscore_rows(neural_vecs)
+    zy = zy - zy.mean(axis=-1, keepdims=True)
+    model_perm = model_rdms[:, perms[:, :, None], perms[:, None, :]] # (n_seq, n_perm, L, L)
+    zx = _zscore_rows(upper_tri(model_perm))
+    zx = zx - zx.mean(axis=-1, keepdims=True)
+    # OLS slope with intercept; 0 for a relabelling whose model vector is flat (as the pseudo-inverse in rdm_regression)
+    ss_x = np.einsum('spk,spk->sp', zx, zx)
+    null = np.einsum('sk,spk->sp', zy, zx) / np.where(ss_x > 1e-12, ss_x, np.inf)
+    p_value = np.mean(null >= null[:, :1] - 1e-12, axis=1)
+    return null, p_value
+
+
+def sequence_rsa(distance, valid_labels, sequences, model_rdms, perms=None):
+    """
+    RSA of all sequences of one domain.
+
+    distance: (n_valid, n_valid) distances of the valid conditions, correlation_distance(means) or crossnobis_distance().
+    model_rdms: {label tuple: model RDM}. Returns (results, skipped): results is one dict per sequence with labels,
+    neural_rdm, model_rdm, beta, intercept and corr (and p_value, n_perm with perms from position_permutations);
+    skipped lists (labels, reason) of the sequences left out.
+    """
+    sequences = [tuple(str(lab) for lab in seq) for seq in sequences] # np.str_ -> str
+    rdms, kept = sequence_rdms(distance, [str(lab) for lab in valid_labels], sequences)
+    skipped = [(sequences[i_seq], 'missing condition means') for i_seq in range(len(sequences)) if i_seq not in kept]
+    # crossnobis: a pair of conditions never measured in two different runs has no distance
+    no_dist = [i_kept for i_kept in range(len(kept)) if np.isnan(rdms[i_kept]).any()]
+    skipped += [(sequences[kept[i_kept]], 'conditions not in two runs') for i_kept in no_dist]
+    rdms = np.delete(rdms, no_dist, axis=0)
+    kept = [i_seq for i_kept, i_seq in enumerate(kept) if i_kept not in no_dist]
+
+    matched = [(i_kept, sequences[i_seq]) for i_kept, i_seq in enumerate(kept) if sequences[i_seq] in model_rdms]
+    skipped += [(sequences[i_seq], 'no matching model RDM') for i_seq in kept if sequences[i_seq] not in model_rdms]
+    if len(matched) == 0:
+        return [], skipped
+
+    neural = rdms[[i_kept for i_kept, _ in matched]]
+    model  = np.stack([np.asarray(model_rdms[labels], dtype=np.float64) for _, labels in matched])
+    fit    = rdm_regression(upper_tri(neural), upper_tri(model))
+    if perms is not None:
+        _, p_value = rdm_permutation_test(upper_tri(neural), model, perms)
+    results = [{
+        'labels':     list(labels),
+        'neural_rdm': neural[i],
+        'model_rdm':  model[i],
+        'beta':       float(fit['beta'][i]),
+        'intercept':  float(fit['intercept'][i]),
+        'corr':       float(fit['corr'][i]),
+        **({'p_value': float(p_value[i]), 'n_perm': len(perms)} if perms is not None else {}),
+    } for i, (_, labels) in enumerate(matched)]
+    return results, skipped
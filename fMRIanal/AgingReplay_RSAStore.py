@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # RSA output store: one Parquet dataset per ROI instead of per-sequence CSVs
+# ========================================================================================================================================================
+# Every RSA run of one subject (all domains and sequences of one HRF peak / TRword / space / T) is written as one part:
+#   <store_root>/<ROI_name>/<subID_num>_<subID_str>_<tag>.parquet
+# with one row per (domain, sequence) and the columns
+#   subID_num, subID_str, ROI, HRF_peak_s, TRword, space, T, domain, rdm_method, sequence, beta, intercept, corr - the beta table
+#   p_value, n_perm                                                                                              - permutation test of the beta (NaN / 0 if off)
+#   labels (list of the sequence's conditions), neural_rdm, model_rdm                                            - RDMs, flattened
+# The RDMs are fixed-size lists of L*L values (L = len(labels)); read_rsa_rdms() returns them as (n, L, L) arrays.
+# Parts are written to a temporary file and renamed, so a re-run of a subject replaces its part and a group reader
+# never sees a half-written file. The directory of an ROI is read as one dataset, and only the requested columns
+# (e.g. the betas without the RDMs) are loaded.
+#
+# Needs pyarrow (conda install pyarrow, see setup_conda_hummel_DecodingReplay.sh).
+# ========================================================================================================================================================
+
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+key_columns  = ['subID_num', 'subID_str', 'ROI', 'HRF_peak_s', 'TRword', 'space', 'T', 'domain', 'rdm_method']
+beta_columns = key_columns + ['sequence', 'beta', 'intercept', 'corr', 'p_value', 'n_perm']
+
+
+def part_file(store_root, ROI_name, subID_num, subID_str, tag):
+    return os.path.join(store_root, ROI_name, f"{subID_num}_{subID_str}_{tag}.parquet")
+
+
+def write_rsa_part(store_root, ROI_name, subID_num, subID_str, tag, rows, neural_rdms, model_rdms, labels):
+    """Write the beta rows (list of dicts) of one subject with their RDMs (n_rows, L, L) and labels (n_rows, L); returns the file."""
+    neural_rdms = np.asarray(neural_rdms, dtype=np.float64)
+    model_rdms  = np.asarray(model_rdms, dtype=np.float64)
+    n_rows, L   = len(rows), neural_rdms.shape[-1]
+    beta_df = pd.DataFrame(rows, columns=beta_columns)
+    beta_df['p_value'] = beta_df['p_value'].astype(np.float64)
+    beta_df['n_perm']  = beta_df['n_perm'].fillna(0).astype(np.int64)
+    table = pa.Table.from_pandas(beta_df, preserve_index=False)
+    table = table.append_column('labels', pa.array([list(map(str, lab)) for lab in labels], type=pa.list_(pa.string())))
+    for name, rdms in [('neural_rdm', neural_rdms), ('model_rdm', model_rdms)]:
+        flat = pa.array(rdms.reshape(n_rows * L * L))
+        table = table.append_column(name, pa.FixedSizeListArray.from_arrays(flat, L * L))
+
+    save_file = part_file(store_root, ROI_name, subID_num, subID_str, tag)
+    os.makedirs(os.path.dirname(save_file), exist_ok=True)
+    pq.write_table(table, save_file + '.tmp')
+    os.replace(save_file + '.tmp', save_file)
+    return save_file
+
+
+def _dataset_files(store_root, ROI_name):
+    roi_dir = os.path.join(store_root, ROI_name)
+    return sorted(os.path.join(roi_dir, f) for f in os.listdir(roi_dir) if f.endswith('.parquet'))
+
+
+def read_rsa_betas(store_root, ROI_name, columns=None, filters=None):
+    """
+    Beta table of all subjects of one ROI (the beta columns by default).
+
+    filters: pyarrow filters on the rows, e.g. [('HRF_peak_s', '==', 5), ('domain', '==', 'item')].
+    """
+    if columns is None:
+        columns = beta_columns
+    return pq.ParquetDataset(_dataset_files(store_root, ROI_name), filters=filters).read(columns=columns).to_pandas()
+
+
+def read_rsa_rdms(store_root, ROI_name, which='neural_rdm', filters=None, index_columns=('subID_num', 'HRF_peak_s', 'domain', 'sequence')):
+    """(index, rdms): the index columns as a DataFrame and the RDMs (n_rows, L, L) of the same rows."""
+    table = pq.ParquetDataset(_dataset_files(store_root, ROI_name), filters=filters).read(columns=list(index_columns) + [which])
+    column = table.column(which).combine_chunks()
+    L = int(round(np.sqrt(column.type.list_size)))
+    rdms = column.flatten().to_numpy().reshape(len(column), L, L)
+    return table.drop_columns([which]).to_pandas(), rdms
+
+
+def average_over_sequences(betas):
+    """Mean beta, intercept and corr over the sequences of every subject / ROI / HRF peak / domain, with n_sequences."""
+    avg = betas.groupby(key_columns, sort=False, dropna=False).agg(
+        beta=('beta', 'mean'), intercept=('intercept', 'mean'), corr=('corr', 'mean'), n_sequences=('beta', 'size'),
+    ).reset_index()
+    avg.insert(len(key_columns), 'sequence', 'AVERAGE_over_sequences')
+    return avg
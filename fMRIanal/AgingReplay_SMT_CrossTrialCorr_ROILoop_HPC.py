@@ -36,11 +36,17 @@ from sklearn.model_selection import cross_validate, cross_val_predict
 from sklearn.linear_model import LogisticRegression, LinearRegression
 from sklearn.pipeline import Pipeline
 from nilearn.maskers import NiftiMasker
-from nilearn.masking import intersect_masks
-import nibabel as nib
 
 from scipy.stats import zscore
 
+from AgingReplay_FeatureCache import feature_dtype, load_mask_intersect, load_smt_tensor, roi_mask_files
+from AgingReplay_SubjectPool import run_subjects, n_subject_workers
+from AgingReplay_Checkpoint import Checkpoint
+from AgingReplay_Dependencies import inputs_digest, smt_input_files, behavior_file
+from AgingReplay_BehaviorLoader import load_behavior
+from AgingReplay_CrossTrialCorr import split_half_cross_corr
+from AgingReplay_SubjectRegistry import subj_list, subj_ids, subLen, eyeball_subj_list, eyeball_subj_ids, get_subject
+
 # ================================================================
 # --- 1. Handle command-line argument for ROI name ---
 # ================================================================
@@ -64,145 +70,12 @@ path_behv = '/home/mpib/ren/rxj-neurocode/AgingStudy/AgingReplay-InHouseData/Agi
 fMRI_predata_path = '/home/mpib/ren/rxj-neurocode/AgingStudy/AgingStudy-fMRI-data/fMRI-PreprocessedData'
 fMRI_preRes_path  = '/home/mpib/ren/rxj-neurocode/AgingStudy/AgingStudy-fMRI-data/fMRI-PreprocessResult'
 path_ROI          = '/home/mpib/ren/rxj-neurocode/AgingStudy/AgingStudy-fMRI-data/Decoding/output_mask'
-subj_list = ['JI9FBD', 'DS56RI', '0TSX26', '0KDSM1', '34HZBU', 'JFD947', '1YLTBH', '2IMSQ1', 'F0MP4R', 'ISAL7K', # sub0-9
-             'V75YLW', 'G39NYH', 'KB9Y23', 'PQV62B', 'PN1J6S', 'D7ZC32', 'ZTB3C6', 'PAE1Z6', 'H9YF0P', 'NGS98A', # sub11-21
-             'I5O2AG', '0HUA8H', '9UQ4LO', 'BVAN57', '1OLZ78', 'R94NKY', 'HV9GS2', 'X30G9L', 'AC14EG', 'FVL29M', # sub22-32; 
-             '5KU60C', '4POAI5', 'AW73C4', 'J7ZK18', '0NMLX1', '5L31VH', 'WJ4V80', '0CH2V5', '3FL47P', '4GDKS3',
-             'DP3HN2', '54BKAN', 'Q5UD9N', '0MHR1L', '498ITS', 'ZLO65J', 'A0L3GF', 'JSD705', '29RT0L', '7H3LT4',
-             'P8HG10', 'AXY95M', 'TF7SV8', 'F2T3IP', 'O9D3TK', '9BAZY6', 'MFV73X', 'PGK25A', 'ZE40UX', '7S84EL', 
-             'IUC51R', 'P1GL2A', '0UC5EX', 'GN8H7S', '4YX0QJ', 'R86IAV', 'DVA10E', 'THY413', 'WN9SJ7', 'HW48KL',
-             '38VXJW', 'XWT5Q7', 'SGH1L7', 'PKHU64', 'X7FW58', 'AN2Q4P', 'UE2N3V', 'EOQ68N', '1CSZ8U', '6YD50L',
-             'R5NM7F', 'M125IE', 'W15AIE', '8H0SUC', 'T0Z37Y', 'SX06IP', 'EIH2T8', '3YQFD7', 'IJS35F', # 'S28NAH': no behavioral data and fMRI data in the block 5
-             'Q20RXI', 'E46LTX', 'X6N1OV', 'FDOC83', '7WXVN6', 'M2NPT9', '34UGKJ', 'BDX6S2', 'U19AMO', '6GBYQ8', 
-             'R0IJF6', '0DK8JB', 'O6P4HN', '659CYO', 'C274BR', 'JS5XW1', '85VOFG', 'F34K9G', 'BY5FA7', 'UM25JN'] # 'TSD0O8';
-subj_conds = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, # 0: six 3-reports trials + two recons-only trials in each block
-              0, 1, 1, 1, 1, 1, 1, 1, 1, 1, # 1: from block 3, all one-report trials, including 6 marginal reports and 2 recons-only trials
-              1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-              1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-              1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-              1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-              1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-              1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-              1, 1, 1, 1, 1, 1, 1, 1, 1, # 1,
-              1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-              1, 1, 1, 1, 1, 1, 1, 1, 1, 1] # 1, 
-subj_ids  = ['sub-00', 'sub-01', 'sub-02', 'sub-03', 'sub-04', 'sub-05', 'sub-06', 'sub-07', 'sub-08', 'sub-09',
-             'sub-11', 'sub-12', 'sub-13', 'sub-14', 'sub-15', 'sub-16', 'sub-17', 'sub-18', 'sub-20', 'sub-21', 
-             'sub-22', 'sub-24', 'sub-25', 'sub-26', 'sub-27', 'sub-28', 'sub-29', 'sub-30', 'sub-31', 'sub-32', 
-             'sub-33', 'sub-34', 'sub-35', 'sub-36', 'sub-37', 'sub-38', 'sub-39', 'sub-40', 'sub-41', 'sub-42',
-             'sub-43', 'sub-44', 'sub-45', 'sub-46', 'sub-47', 'sub-48', 'sub-49', 'sub-50', 'sub-51', 'sub-52',
-             'sub-54', 'sub-55', 'sub-56', 'sub-57', 'sub-58', 'sub-59', 'sub-60', 'sub-61', 'sub-62', 'sub-63',
-             'sub-64', 'sub-65', 'sub-66', 'sub-67', 'sub-68', 'sub-69', 'sub-70', 'sub-71', 'sub-72', 'sub-73',
-             'sub-74', 'sub-75', 'sub-76', 'sub-77', 'sub-78', 'sub-79', 'sub-80', 'sub-81', 'sub-82', 'sub-83',
-             'sub-84', 'sub-85', 'sub-86', 'sub-87', 'sub-89', 'sub-91', 'sub-92', 'sub-93', 'sub-94', # 'sub-90', 
-             'sub-96', 'sub-97', 'sub-99', 'sub-100','sub-101','sub-102','sub-103','sub-104','sub-105','sub-106',
-             'sub-107','sub-108','sub-109','sub-110','sub-111','sub-112','sub-113','sub-114','sub-115','sub-116'] # 'sub-53'
-subj_Grp  = ['YA',     'YA',     'YA',     'YA',     'YA',     'YA',     'YA',     'YA',     'OA',     'YA',
-             'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'YA',     'YA',
-             'OA',     'YA',     'OA',     'YA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA', 
-             'OA',     'OA',     'OA',     'YA',     'OA',     'YA',     'OA',     'OA',     'OA',     'OA',
-             'OA',     'OA',     'OA',     'YA',     'YA',     'OA',     'OA',     'OA',     'OA',     'OA',
-             'YA',     'YA',     'YA',     'YA',     'OA',     'YA',     'OA',     'YA',     'OA',     'YA',
-             'YA',     'YA',     'YA',     'YA',     'OA',     'YA',     'YA',     'YA',     'YA',     'OA',
-             'YA',     'YA',     'YA',     'YA',     'YA',     'YA',     'YA',     'YA',     'YA',     'OA',
-             'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA', # 'OA',     
-             'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',
-             'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA',     'OA'] # 'OA',     
-subj_Gen  = ['F',      'F',      'M',      'F',      'M',      'M',      'M',      'F',      'F',      'F',
-             'F',      'M',      'M',      'M',      'F',      'M',      'F',      'F',      'F',      'F',
-             'M',      'M',      'M',      'M',      'M',      'F',      'F',      'F',      'F',      'M', 
-             'M',      'F',      'F',      'F',      'M',      'M',      'M',      'F',      'F',      'M', 
-             'F',      'M',      'M',      'M',      'F',      'F',      'M',      'M',      'M',      'M',
-             'M',      'M',      'F',      'F',      'F',      'M',      'F',      'M',      'F',      'F',
-             'M',      'M',      'F',      'F',      'F',      'M',      'M',      'F',      'F',      'F',
-             'F',      'F',      'F',      'M',      'F',      'F',      'F',      'M',      'M',      'M',
-             'F',      'F',      'F',      'F',      'F',      'F',      'F',      'M',      'M', # 'F',      
-             'M',      'M',      'F',      'F',      'M',      'F',      'M',      'F',      'M',      'F',
-             'F',      'M',      'F',      'M',      'M',      'F',      'F',      'F',      'F',      'M'] # 'F',      
-subLen    = len(subj_list)
-smtData_list = ['2023-09-28_08h10.21.524', '2023-11-07_12h21.54.858', '2023-11-08_12h03.23.545', '2023-11-08_15h10.19.205', '2023-11-14_12h26.41.641',
-                '2023-11-15_16h25.22.624', '2023-11-29_13h10.27.075', '2023-12-04_14h21.48.292', '2023-12-13_15h26.11.242', '2023-12-20_14h13.37.842',
-                '2024-03-06_14h51.12.188', '2024-03-12_09h00.28.550', '2024-03-13_13h39.04.471', '2024-03-13_15h22.04.307', '2024-03-19_09h07.10.114',
-                '2024-03-20_13h29.23.858', '2024-03-25_14h55.23.013', '2024-03-27_15h09.18.625', '2024-04-15_16h15.06.663', '2024-04-22_15h16.52.756',
-                '2024-06-11_12h34.56.855', '2024-07-16_09h04.02.385', '2024-07-23_10h31.20.475', '2024-07-24_13h03.12.582', '2024-07-30_09h42.04.952',
-                '2024-07-30_11h40.23.996', '2024-08-07_13h35.38.022', '2024-08-14_13h05.46.869', '2024-08-20_09h02.05.721', '2024-08-27_08h56.33.363', 
-                '2024-09-10_10h04.49.686', '2024-09-17_09h33.29.370', '2024-09-17_11h08.13.256', '2024-10-08_10h14.17.919', '2024-10-08_11h27.05.290',
-                '2024-10-15_09h09.15.617', '2024-10-15_12h50.58.451', '2024-10-22_12h42.43.034', '2024-10-28_15h04.42.286', '2024-10-30_15h46.36.217',
-                '2024-11-05_09h14.48.552', '2024-11-08_10h49.02.025', '2024-11-12_14h50.54.626', '2024-11-15_13h38.16.342', '2024-11-20_15h48.30.080',
-                '2024-11-25_15h10.17.731', '2025-02-04_09h56.11.417', '2025-01-28_09h17.21.761', '2025-01-21_09h11.31.992', '2025-02-11_08h51.27.911', 
-                '2025-02-25_08h51.57.056', '2025-03-04_09h10.24.733', '2025-03-04_10h45.44.121', '2025-03-04_17h43.56.474', '2025-03-08_09h09.12.369', 
-                '2025-03-08_11h02.15.424', '2025-03-11_17h26.05.761', '2025-03-12_13h06.54.798', '2025-03-18_09h07.54.814', '2025-03-18_10h48.52.340',
-                '2025-03-18_17h52.43.858', '2025-03-22_09h08.29.675', '2025-03-22_10h39.34.519', '2025-03-22_14h08.39.650', '2025-03-29_13h57.05.875',
-                '2025-04-01_09h01.28.280', '2025-04-01_16h04.27.502', '2025-04-05_09h05.18.704', '2025-04-05_10h42.43.204', '2025-04-05_14h11.03.375',
-                '2025-04-08_09h05.18.220', '2025-04-15_12h43.28.098', '2025-04-19_10h03.27.794', '2025-04-19_11h34.22.980', '2025-04-19_13h56.10.038',
-                '2025-04-22_08h56.05.004', '2025-04-22_17h02.46.579', '2025-04-24_17h01.02.940', '2025-04-29_17h19.51.289', '2025-05-20_09h10.23.876',
-                '2025-06-24_09h01.09.686', '2025-07-05_12h29.01.635', '2025-07-08_09h10.37.608', '2025-07-12_12h39.33.346', '2025-07-15_10h50.24.239',
-                '2025-07-22_09h08.14.717', '2025-07-22_10h50.10.422', '2025-07-26_10h58.25.697', '2025-07-29_09h11.54.623', # '2025-07-15_12h24.42.883', 
-                '2025-07-29_12h22.55.149', '2025-08-09_10h06.29.871', '2025-08-09_17h52.23.229', '2025-08-09_16h09.19.996', '2025-08-11_16h14.00.079',
-                '2025-08-13_08h58.45.554', '2025-08-13_10h38.04.617', '2025-08-13_16h20.39.496', '2025-08-19_09h15.43.593', '2025-08-19_10h48.14.146',
-                '2025-08-19_16h07.42.928', '2025-08-21_16h23.19.920', '2025-09-09_09h14.21.589', '2025-09-09_16h19.23.893', '2025-09-13_08h55.23.633',
-                '2025-09-13_10h42.16.239', '2025-09-16_08h54.36.888', '2025-09-16_10h40.38.770', '2025-09-20_09h05.08.118', '2025-09-20_10h57.13.396'] 
-
-locData_list = ['2023-09-28_14h12.56.518', '2023-11-08_16h48.30.873', '2023-11-09_16h11.02.674', '2023-11-10_16h15.27.003', '2023-11-14_16h14.58.453',
-                '2023-11-16_16h19.27.518', '2023-11-30_16h26.12.803', '2023-12-05_10h55.41.830', '2023-12-14_17h22.16.905', '2023-12-21_14h48.08.816', 
-                '2024-03-07_15h47.49.146', '2024-03-15_14h01.51.453', '2024-03-14_16h10.58.431', '2024-03-18_14h43.06.229', '2024-03-20_15h24.15.997',
-                '2024-03-21_15h40.30.309', '2024-03-27_13h21.24.043', '2024-03-28_12h07.59.279', '2024-04-16_08h56.05.511', '2024-04-24_14h39.13.617', 
-                '2024-06-12_14h58.24.877', '2024-07-17_13h06.22.770', '2024-07-24_11h21.01.554', '2024-07-31_12h06.33.131', '2024-07-31_13h40.36.111',
-                '2024-07-31_15h14.59.533', '2024-08-26_08h17.05.765', '2024-08-21_11h31.01.752', '2024-08-21_13h05.21.235', '2024-08-28_11h28.51.541', 
-                '2024-09-11_11h46.21.555', '2024-09-18_11h31.25.597', '2024-09-18_13h35.01.061', '2024-10-09_12h37.51.712', '2024-10-09_14h08.38.731',
-                '2024-10-23_13h16.08.319', '2024-10-16_13h40.56.719', '2024-10-25_12h46.34.787', '2024-10-29_15h50.53.023', '2024-11-01_12h51.41.305',
-                '2024-11-06_15h03.52.289', '2024-11-11_15h02.01.801', '2024-11-13_15h17.56.569', '2024-11-18_15h04.23.076', '2024-11-22_15h13.23.596',
-                '2025-02-05_10h22.15.474', '2025-02-05_11h56.20.664', '2025-01-29_11h31.23.686', '2025-01-22_11h34.15.216', '2025-02-12_11h30.38.491',
-                '2025-02-26_11h51.08.964', '2025-03-05_11h31.01.311', '2025-03-05_13h16.10.270', '2025-03-05_17h22.22.571', '2025-03-09_08h55.47.043', 
-                '2025-03-09_11h14.45.199', '2025-03-12_15h59.04.598', '2025-03-14_17h00.43.853', '2025-03-19_11h31.37.973', '2025-03-19_13h23.08.607',
-                '2025-03-19_17h48.38.268', '2025-03-23_09h01.48.727', '2025-03-23_10h44.52.869', '2025-03-23_12h23.55.884', '2025-03-31_17h22.15.850',
-                '2025-04-02_11h32.25.159', '2025-04-02_16h06.53.734', '2025-04-06_08h54.46.511', '2025-04-06_10h58.29.983', '2025-04-06_12h39.18.492',
-                '2025-04-09_14h06.02.361', '2025-04-17_17h16.34.354', '2025-04-20_08h52.06.111', '2025-04-20_10h48.25.255', '2025-04-20_12h27.05.023',
-                '2025-04-25_17h00.52.891', '2025-04-23_16h38.16.664', '2025-04-25_13h35.09.338', '2025-04-30_17h12.52.913', '2025-05-21_16h07.48.679',
-                '2025-06-25_08h55.15.622', '2025-07-06_12h17.06.370', '2025-07-11_08h32.56.172', '2025-07-13_11h52.46.942', '2025-07-18_10h19.57.273',
-                '2025-07-25_08h36.42.589', '2025-07-25_10h05.00.383', '2025-07-27_10h41.11.084', '2025-08-01_08h34.18.084', # '2025-07-18_11h56.32.412',
-                '2025-08-01_11h27.46.474', '2025-08-10_10h30.07.978', '2025-08-10_17h13.33.724', '2025-08-10_15h31.02.947', '2025-08-12_16h29.31.238',
-                '2025-08-14_16h05.35.469', '2025-08-14_17h40.25.833', '2025-08-15_16h59.33.246', '2025-08-20_09h12.28.877', '2025-08-20_10h39.55.897',
-                '2025-08-20_16h11.52.133', '2025-08-22_08h55.44.631', '2025-09-10_09h20.15.132', '2025-09-10_10h57.53.482', '2025-09-14_08h57.50.046',
-                '2025-09-14_10h37.51.272', '2025-09-18_08h55.50.912', '2025-09-18_10h27.46.358', '2025-09-21_08h56.54.549', '2025-09-21_11h04.08.482']
-
-locStim_csv_list = ['x',  'x',  'x',  '01', '02', '03', '04', '05', '01', '01', 
-                    '02', '04', '03', '05', '01', '02', '03', '04', '01', '02', # Except for the last participant ('ISAL7K'), the index of the joint stimuli for the remaining participants ranges from 1 to 64
-                    '03', '01', '02', '03', '04', '05', '01', '02', '03', '04', 
-                    '05', '01', '02', '03', '04', '01', '05', '02', '03', '04',
-                    '05', '01', '02', '03', '04', '05', '01', '03', '02', '04',
-                    '02', '04', '05', '02', '02', '03', '04', '05', '01', '02',
-                    '03', '04', '05', '01', '03', '04', '05', '01', '02', '03',
-                    '04', '02', '02', '03', '04', '05', '01', '02', '03', '04',
-                    '05', '01', '02', '03', '04', '01', '02', '05', '01', # '05', 
-                    '03', '04', '01', '02', '03', '04', '05', '01', '02', '03', 
-                    '04', '05', '02', '03', '04', '05', '01', '02', '03', '04'] # ; '01';  From participant '0HUA8H', we used a new localizer task, the stimuli are named 'LocMemRecStim0x.csv'
-session_words = ['EpiMemTask', 'LocalizerTask']
-
+# ----------subject lists and per-subject settings: AgingReplay_SubjectRegistry.py----------
 eyeball_anal = 'no'
-if eyeball_anal == 'yes':
-    subj_list     = ['0UC5EX', '7S84EL', '38VXJW', '498ITS',
-                     'AN2Q4P', 'AXY95M', 'DVA10E', 'EOQ68N',
-                     'GN8H7S', 'IUC51R', 'NGS98A', 'P1GL2A',
-                     'PKHU64', 'R86IAV', 'SGH1L7', 'TF7SV8',
-                     'THY413', 'UE2N3V', 'WN9SJ7', 'X7FW58']
-    subj_ids      = ['sub-66', 'sub-63', 'sub-74', 'sub-47',
-                     'sub-79', 'sub-55', 'sub-70', 'sub-81',
-                     'sub-67', 'sub-64', 'sub-21', 'sub-65',
-                     'sub-77', 'sub-69', 'sub-76', 'sub-56',
-                     'sub-71', 'sub-80', 'sub-72', 'sub-78'] 
-    smtData_list  = ['2025-03-22_10h39.34.519', '2025-03-18_10h48.52.340', '2025-04-08_09h05.18.220', '2024-11-20_15h48.30.080',
-                     '2025-04-22_08h56.05.004', '2025-03-04_09h10.24.733', '2025-04-01_16h04.27.502', '2025-04-24_17h01.02.940',
-                     '2025-03-22_14h08.39.650', '2025-03-18_17h52.43.858', '2024-04-22_15h16.52.756', '2025-03-22_09h08.29.675',
-                     '2025-04-19_11h34.22.980', '2025-04-01_09h01.28.280', '2025-04-19_10h03.27.794', '2025-03-04_10h45.44.121'
-                     '2025-04-05_09h05.18.704', '2025-04-22_17h02.46.579', '2025-04-05_10h42.43.204', '2025-04-19_13h56.10.038']
-    etData_list   = ['2025_03_22_10_39',        '2025_03_18_10_48',        '2025_04_08_09_05',        '2024_11_20_15_48',
-                     '2025_04_22_08_56',        '2025_03_04_09_10',        '2025_04_01_16_04',        '2025_04_24_17_01',
-                     '2025_03_22_14_08',        '2025_03_18_17_52',        '2024_04_22_15_16',        '2025_03_22_09_08',
-                     '2025_04_19_11_34',        '2025_04_01_09_01',        '2025_04_19_10_03',        '2025_03_04_10_45',
-                     '2025_04_05_09_05',        '2025_04_22_17_02',        '2025_04_05_10_42',        '2025_04_19_13_56']
-    session_words = ['EpiMemTask', 'LocalizerTask']
-    subLen        = len(subj_list)
+# subjects of this run: the subset for the eye-tracking analysis or all of them (the settings are looked up by subject code)
+run_subj_list = eyeball_subj_list if eyeball_anal == 'yes' else subj_list
+run_subj_ids  = eyeball_subj_ids if eyeball_anal == 'yes' else subj_ids
+run_subLen    = len(run_subj_list)
 
 
 # In[4]:
@@ -248,123 +121,6 @@ noise_model = 'ar1'
 standarize = False
 
 
-# In[6]:
-
-
-# --------The folder contains the anatomical runs--------
-session_List = ['', # sub-00
-                '', # sub-01
-                '', # sub-02
-                'ses-SeqMemTask', # sub-03
-                'ses-SeqMemTask', # sub-04
-                'ses-SeqMemTask', # sub-05
-                'ses-SeqMemTask', # sub-06
-                'ses-SeqMemTask', # sub-07
-                'ses-locTask', # sub-08
-                'ses-SeqMemTask', # sub-09
-                'ses-SeqMemTask', # sub-11
-                'ses-SeqMemTask', # sub-12
-                'ses-SeqMemTask', # sub-13
-                'ses-SeqMemTask', # sub-14
-                'ses-SeqMemTask', # sub-15
-                'ses-SeqMemTask', # sub-16
-                'ses-SeqMemTask', # sub-17
-                'ses-SeqMemTask', # sub-18
-                'ses-SeqMemTask', # sub-20
-                'ses-SeqMemTask', # sub-21
-                'ses-SeqMemTask', # sub-22
-                'ses-SeqMemTask', # sub-24
-                'ses-SeqMemTask', # sub-25
-                'ses-SeqMemTask', # sub-26
-                'ses-SeqMemTask', # sub-27
-                'ses-SeqMemTask', # sub-28
-                'ses-SeqMemTask', # sub-29
-                'ses-SeqMemTask', # sub-30
-                'ses-SeqMemTask', # sub-31
-                'ses-SeqMemTask', # sub-32
-                'ses-SeqMemTask', # sub-33
-                'ses-SeqMemTask', # sub-34
-                'ses-SeqMemTask', # sub-35
-                'ses-SeqMemTask', # sub-36
-                'ses-SeqMemTask', # sub-37
-                'ses-SeqMemTask', # sub-38
-                'ses-SeqMemTask', # sub-39
-                'ses-SeqMemTask', # sub-40
-                'ses-SeqMemTask', # sub-41
-                'ses-SeqMemTask', # sub-42
-                'ses-SeqMemTask', # sub-43
-                'ses-SeqMemTask', # sub-44
-                'ses-SeqMemTask', # sub-45
-                'ses-SeqMemTask', # sub-46
-                'ses-SeqMemTask', # sub-47
-                'ses-SeqMemTask', # sub-48
-                'ses-SeqMemTask', # sub-49
-                'ses-SeqMemTask', # sub-50
-                'ses-SeqMemTask', # sub-51
-                'ses-SeqMemTask', # sub-52 # 'ses-SeqMemTask', # sub-53
-                'ses-SeqMemTask', # sub-54
-                'ses-SeqMemTask', # sub-55
-                'ses-SeqMemTask', # sub-56
-                'ses-SeqMemTask', # sub-57
-                'ses-SeqMemTask', # sub-58
-                'ses-SeqMemTask', # sub-59
-                'ses-SeqMemTask', # sub-60
-                'ses-SeqMemTask', # sub-61
-                'ses-SeqMemTask', # sub-62
-                'ses-SeqMemTask', # sub-63
-                'ses-SeqMemTask', # sub-64
-                'ses-SeqMemTask', # sub-65
-                'ses-SeqMemTask', # sub-66
-                'ses-SeqMemTask', # sub-67
-                'ses-SeqMemTask', # sub-68
-                'ses-SeqMemTask', # sub-69
-                'ses-SeqMemTask', # sub-70
-                'ses-SeqMemTask', # sub-71
-                'ses-SeqMemTask', # sub-72
-                'ses-SeqMemTask', # sub-73
-                'ses-SeqMemTask', # sub-74
-                'ses-SeqMemTask', # sub-75
-                'ses-SeqMemTask', # sub-76
-                'ses-SeqMemTask', # sub-77
-                'ses-SeqMemTask', # sub-78
-                'ses-SeqMemTask', # sub-79
-                'ses-SeqMemTask', # sub-80
-                'ses-SeqMemTask', # sub-81
-                'ses-SeqMemTask', # sub-82 
-                'ses-SeqMemTask', # sub-83... 78 
-                'ses-SeqMemTask', # sub-84... 84 
-                'ses-SeqMemTask', # sub-85... 85 
-                'ses-SeqMemTask', # sub-86... 86 
-                'ses-SeqMemTask', # sub-87... 87
-                'ses-SeqMemTask', # sub-89... 88
-                'ses-SeqMemTask', # sub-90... 89
-                'ses-SeqMemTask', # sub-91... 90
-                'ses-SeqMemTask', # sub-92... 91
-                'ses-SeqMemTask', # sub-93... 92
-                'ses-SeqMemTask', # sub-94... 93
-                'ses-SeqMemTask', # sub-96... 94
-                'ses-SeqMemTask', # sub-97... 95
-                'ses-SeqMemTask', # sub-99... 96
-                'ses-SeqMemTask', # sub-100... 97
-                'ses-SeqMemTask', # sub-101... 98
-                'ses-SeqMemTask', # sub-102... 99
-                'ses-SeqMemTask', # sub-103... 100
-                'ses-SeqMemTask', # sub-104... 101
-                'ses-SeqMemTask', # sub-105... 102
-                'ses-SeqMemTask', # sub-106... 103
-                'ses-SeqMemTask', # sub-107... 104
-                'ses-SeqMemTask', # sub-108... 105
-                'ses-SeqMemTask', # sub-109... 106
-                'ses-SeqMemTask', # sub-110... 107
-                'ses-SeqMemTask', # sub-111... 108
-                'ses-SeqMemTask', # sub-112... 109
-                'ses-SeqMemTask', # sub-113... 110
-                'ses-SeqMemTask', # sub-114... 111
-                'ses-SeqMemTask', # sub-115... 112
-                'ses-SeqMemTask'  # sub-116... 113     
-] # store the folder for the anatomical image
-
-
 # In[7]:
 
 
@@ -380,6 +136,9 @@ AngleNames_generalB2 = ['1AngRightup', '2AngUp', '3AngLeftup', '4AngLeft', '5Ang
 
 def cosine_similarity(a, b):
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+# split_half_cross_corr(): AgingReplay_CrossTrialCorr.py
     
 # In[ ]:
 
@@ -387,7 +146,8 @@ def cosine_similarity(a, b):
 nTrial = 8 # 8 trials per block
 nEle   = 5 # each sequence contains 5 elements
 nSeq   = 2 # two unique item sequences and two unique location sequences
-n_repeats = 50 # 50 times of random split for the trials
+n_repeats = 50 # 50 times of random split for the trials (vectorized: thousands are affordable)
+rng_seedSeq = np.random.SeedSequence() # random splits; pass a seed for reproducible output
 
 # ---------- Pair of the TRs for the cross stage (Encoding vs. WTI), cross-trial correlation ----------
 TR_pairs = np.array([[0, 1, 2, 3, 4],
@@ -429,8 +189,39 @@ sesName = 'ses-SeqMemTask-SMTtrain'
 crossCorr_saveDir = os.path.join(*[fMRI_preRes_path, 'smtData-folder', sesName, 'Cross-Correlation'])
 if not os.path.exists(crossCorr_saveDir):
     os.makedirs(crossCorr_saveDir)
-    
+
+# ----------intersected ROI masks as voxel indices + affine, shared by all scripts (AgingReplay_FeatureCache.py)----------
+maskCache_dir = os.path.join(fMRI_preRes_path, 'feature-cache', 'roi-masks')
+
+# ----------parsed behavioral csv of every subject, shared by all scripts (AgingReplay_BehaviorLoader.py)----------
+behaviorCache_dir = os.path.join(fMRI_preRes_path, 'feature-cache', 'behavior')
+
 trainData_word = 'SMT'
+
+# ----------subject-level worker pool (SUBJECT_WORKERS / SUBJECT_WORKER_MEM_GB, see AgingReplay_SubjectPool.py)----------
+n_workers = n_subject_workers()
+
+# ----------checkpoints: finished (subject, ROI, HRF peak) units are read back instead of re-run (AgingReplay_Checkpoint.py)----------
+checkpoint = Checkpoint(os.path.join(fMRI_preRes_path, 'checkpoints'), 'SMT_CrossTrialCorr', {
+    'sesName': sesName, 'space': space, 'T': T, 'TRword': TRword, 'event_word': event_word, 'maskSource': maskSource,
+    'smoothing_fwhm': smoothing_fwhm, 'confound_vars': confound_vars, 'nTRanal': nTRanal, 'n_repeats': n_repeats,
+    'standardization_word': standardization_word, 'trainData_word': trainData_word, 'eyeball_anal': eyeball_anal, 'feature_dtype': feature_dtype.name,
+})
+
+def subject_unit(subIdx):
+    return {'sub': run_subj_ids[subIdx] + '-' + run_subj_list[subIdx], 'ROI': ROI_name, 'HRF': HRF_peak}
+
+digest_root = os.path.join(fMRI_preRes_path, 'checkpoints', 'digests') # content hashes of the input files
+
+def subject_inputs(subIdx):
+    # a finished unit is run again when one of its input files changed (AgingReplay_Dependencies.py)
+    sub = get_subject(run_subj_list[subIdx])
+    return inputs_digest(
+        (roi_mask_files(sub.subID_num, ROI_name, sub.nBlock_SMT, sub.nBlock, space, T, path_ROI)
+         + smt_input_files(sub, ROI_name, space, T, TRword, nTRanal, fMRI_preRes_path) + [behavior_file(sub, path_behv)]),
+        digest_root,
+    )
+
 for i_roi in range(0, len(ROI_names)):
     ROI_name = ROI_names[i_roi]
     print('++++++++++++++++++ ROI: ' + ROI_name + '++++++++++++++++++' )
@@ -438,58 +229,20 @@ for i_roi in range(0, len(ROI_names)):
     HRF_peak = HRF_peaks[2] # for each event onset, adding another 5 seconds to find the peak of the activation
     print('++++++++++++++++++ HRF: ' + str(HRF_peak) + ' s ++++++++++++++++++' )
 
-    for subIdx in range(6, subLen): # range(6, subLen)
-        subID_str   = subj_list[subIdx]
-        subID_num   = subj_ids[subIdx]
-        anat_folder = session_List[subIdx]
+    def crossCorr_subject(subIdx):
+        # an independent random stream per subject, identical whichever worker runs the subject
+        rng = np.random.default_rng(np.random.SeedSequence(rng_seedSeq.entropy, spawn_key=(i_roi, subIdx)))
+        sub         = get_subject(run_subj_list[subIdx]) # run/condition settings, see AgingReplay_SubjectRegistry.py
+        subID_str   = sub.subID_str
+        subID_num   = sub.subID_num
         print('++++++++++++++++++ subj: ' + subID_str + ' ++++++++++++++++++' )
-        if subIdx < 10:
-            tr_start = 2 # the stimuli will be displayed in the beginning of the 3rd TR
-        else:
-            tr_start = 3 # the stimuli will be displayed in the beginning of the 4th TR
-                
-        # --------blocks for the sequential memory task--------
-        if subID_str == 'F0MP4R':
-            nBlock_SMT = 2
-        elif subID_str == 'H9YF0P':
-            nBlock_SMT = 3
-        elif subID_str == 'YSZO14':
-            nBlock_SMT = 0
-        elif subID_str == 'J7ZK18' or subID_str == '4GDKS3' or subID_str == 'TSD0O8':
-            nBlock_SMT = 4
-        elif subID_str == 'Q5UD9N' or subID_str == 'JSD705':
-            nBlock_SMT = 5
-        else:
-            nBlock_SMT = 6
-        
-        # --------Blocks for the localizer task--------
-        if subID_str == 'H9YF0P' or subID_str == 'AC14EG' or subID_str == 'A0L3GF' or subID_str == '7S84EL' or subID_str == '6GBYQ8':
-            nBlock = 7
-        elif subID_str == 'NGS98A' or subID_str == 'R94NKY' or subID_str == 'TF7SV8' or subID_str == 'X7FW58':
-            nBlock = 6
-        else:
-            nBlock = 8 
-        
-        # --------Define the starting blocks----------
-        if subID_str == '0KDSM1' or subID_str == '0NMLX1' or subID_str == 'DP3HN2' or subID_str == '54BKAN':
-            nBlock_SMT_on = 1
-        elif subID_str == 'JFD947':
-            nBlock_SMT_on = 2 # should re-run the preprocessing, the first 2 blocks should be deleted
-        else:
-            nBlock_SMT_on = 0
+        nBlock_SMT     = sub.nBlock_SMT # blocks for the sequential memory task
+        nBlock         = sub.nBlock # blocks for the localizer task
+        nBlock_SMT_on  = sub.nBlock_SMT_on # starting block of the sequential memory task
 
         # --------Define which trials should be used in the calculation--------
         trial_start_idx = nBlock_SMT_on * nTrial 
         trial_end_idx   = nBlock_SMT * nTrial 
-        item_start_idx  = nBlock_SMT_on * nTrial * nEle
-        item_end_idx    = nBlock_SMT * nTrial * nEle
-
-        if subIdx < 21:
-            conditions_con = ['cat', 'hat', 'sunflower', 'key', 'castle', 'female', 'cream', 'car']
-            event_word     = "con-pos-resp-fix"
-        else:
-            conditions_con = ['cat', 'cherry', 'couch', 'cutter', 'girl', 'hand', 'house', 'violin']
-            event_word     = event_word_list[0] # "con-pos-fix"
             
         # ----------create a new folder to save the z-maps----------
         smtData_saveDir_name = subID_num + '_' + subID_str
@@ -501,94 +254,20 @@ for i_roi in range(0, len(ROI_names)):
         # -------------------------------------------------------------------------------------------------
         # ----------Import the Behvaioral data in the SeqMem Session----------
         # -------------------------------------------------------------------------------------------------
-        smtData_iSub  = subj_list[subIdx] + '_' + session_words[0] + '_' + smtData_list[subIdx] + '.csv'
+        smtData_iSub  = sub.smtData_csv
         smtData_fname = os.path.join(path_behv, 'data/' + smtData_iSub)
-        smtData_pd    = pd.read_csv(filepath_or_buffer=smtData_fname)
-        
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~Stimuli in the Encoding stage~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # ++++++++++++ The real Item sequence in the Encoding stage ++++++++++
-        # ------Extract the item sequences for each trial------
-        imgName_iBlc = smtData_pd["cueImgName"].dropna()
-        imgName_iBlc_array = imgName_iBlc.to_numpy()
-        imgSeq_Blc = [] # name of images
-        for i in range(0, len(imgName_iBlc_array)):
-            # images
-            imgTgt_i = imgName_iBlc_array[i].split('/')[-1].split('.')[0]
-            imgSeq_Blc.append(imgTgt_i)
-        # ------Convert the list into numpy.array and then reshape it------
-        imgSeq_Blc_array = np.array(imgSeq_Blc)
-        imgSeq_Blc_array = imgSeq_Blc_array[item_start_idx : item_end_idx]
-        imgSeq_mat = imgSeq_Blc_array.reshape((nBlock_SMT - nBlock_SMT_on) * nTrial, nEle)
-        
-        # ++++++++++++ The real Position sequence in the Encoding stage ++++++++++
-        # ------Extract the position sequences for each trial------
-        # relable each position
-        posAng_iBlc = smtData_pd["cueAng"].dropna()
-        posAng_iBlc_array = posAng_iBlc.to_numpy()
-        imgAng_unique = np.unique(posAng_iBlc_array) # corresponding to 'AngleNames_general'
-        if imgAng_unique[0] < 1/(2*nPos) * 2 * np.pi: # 0-22.5 degree
-            AngleNames_generalB = AngleNames_generalB1
-        else: # 22.5-45 degree
-            AngleNames_generalB = AngleNames_generalB2
-        
-        # ----------Relabel the positions----------
-        posSeq_Blc = []
-        for i in range(0, len(posAng_iBlc_array)):
-            # position
-            pos_which  = np.where(posAng_iBlc_array[i] == imgAng_unique)[0][0]
-            pos_word_i = AngleNames_generalB[pos_which]
-            posSeq_Blc.append(pos_word_i) 
-        # ------Convert the list into numpy.array and then reshape it------
-        posSeq_Blc_array = np.array(posSeq_Blc)
-        posSeq_Blc_array = posSeq_Blc_array[item_start_idx : item_end_idx]
-        posSeq_mat = posSeq_Blc_array.reshape((nBlock_SMT - nBlock_SMT_on) * nTrial, nEle)
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~Stimuli in the Encoding stage~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    
-        # ------Report labels: item first (0) or position first (1)
-        rep_mark = smtData_pd["trlTestOrd"].dropna().to_numpy()
-        rep_mark_col = np.zeros((len(rep_mark),), dtype=int)
-        for iT in range(0, len(rep_mark)):
-            # ------WTI labels: short or long------
-            rep_mark_iT      = rep_mark[iT]
-            rep_mark_col[iT] = np.array([float(num) for num in rep_mark_iT.strip('[]').split()])[0]    
-    
-        # ------Recons labels: reconsOnly (1) or not (0)
-        rec_mark = smtData_pd["reconsMark"].dropna().to_numpy()
-        rec_mark_col = np.zeros((len(rec_mark ),), dtype=int)
-        for iT in range(0, len(rec_mark)):
-            # ------WTI labels: short or long------
-            rec_mark_iT      = rec_mark[iT]
-            rec_mark_col[iT] = np.array([float(num) for num in rec_mark_iT.strip('[]').split()])[0]    
-    
-        # ------WTI labels: short (1) or long (0)------
-        WTI_mark = smtData_pd["sWTImark"].dropna().to_numpy()
-        WTI_mark_col = np.zeros((len(WTI_mark),), dtype=int)
-        for iT in range(0, len(WTI_mark)):
-            # ------WTI labels: short or long------
-            WTI_mark_iT      = WTI_mark[iT]
-            WTI_mark_col[iT] = np.array([float(num) for num in WTI_mark_iT.strip('[]').split()])[0]    
-    
-        # ------WTI durations: seconds------
-        WTI_duration = smtData_pd["WTItime"].dropna().to_numpy()
-        WTI_duration_col = np.zeros((len(WTI_duration),))
-        for iT in range(0, len(WTI_duration)):
-            WTI_duration_iT      = WTI_duration[iT]
-            WTI_duration_col[iT] = np.array([float(num) for num in WTI_duration_iT.strip('[]').split()])[0] 
-    
+        # one row per trial: item / position sequence and WTI mark, among others (AgingReplay_BehaviorLoader.py)
+        behavior = load_behavior(smtData_fname, nEle, AngleNames_generalB1, AngleNames_generalB2, behaviorCache_dir)
+
         # ----------Check for some pariticipant if we need to delete some of their learning blocks----------
-        imgSeq_mat_clean = imgSeq_mat
-        posSeq_mat_clean = posSeq_mat
-        WTI_mark_col_clean = WTI_mark_col[trial_start_idx : trial_end_idx]
-        rep_mark_col_clean = rep_mark_col[trial_start_idx : trial_end_idx]
-        rec_mark_col_clean = rec_mark_col[trial_start_idx : trial_end_idx]
-        WTI_duration_col_clean = WTI_duration_col[trial_start_idx : trial_end_idx]
+        behavior_clean = behavior[trial_start_idx : trial_end_idx]
+        imgSeq_mat_clean = behavior_clean['item'] # (n_trials, nEle)
+        posSeq_mat_clean = behavior_clean['pos']
+        WTI_mark_col_clean = behavior_clean['short_wti'].astype(int) # short (1) or long (0)
     
         # ---------- We only use these trials with longWTI ----------
         imgSeq_mat_longWIT = imgSeq_mat_clean[WTI_mark_col_clean == 0, :]
         posSeq_mat_longWTI = posSeq_mat_clean[WTI_mark_col_clean == 0, :]
-        rep_mark_longWTI   = rep_mark_col_clean[WTI_mark_col_clean == 0]
-        rec_mark_longWTI   = rec_mark_col_clean[WTI_mark_col_clean == 0]
-        WTI_duration_longWTI = WTI_duration_col_clean[WTI_mark_col_clean == 0]
     
         # ---------- Create the counterpart sequence for the current trial ----------
         unique_imgSeq = np.unique(imgSeq_mat_longWIT, axis=0)
@@ -623,37 +302,8 @@ for i_roi in range(0, len(ROI_names)):
             matches = np.all(posSeq_mat_longWTI_tgt == seq, axis=1)
             trial_indices_pos_per_seq[i] = np.where(matches)[0]
         
-        # ----------concatenate the mask images----------
-        mask_images_blc = [] 
-        # ----------SeqMemTask----------
-        sesName_SMT = 'ses-SeqMemTask'
-        if nBlock_SMT != 0:
-            for iBlc in range(0, nBlock_SMT):
-                mask_path  = path_ROI + '/output_mask_SMT/' + subID_num + '/' + sesName_SMT + '/' + 'ROIs/' 
-                mask_fname = ROI_name + '_' + subID_num + '_' + sesName_SMT + '_space-' + space + '_T-' + str(int(T*100)) + '_run-0' + str(iBlc+1) + '.nii'
-                mask_file  = os.path.join(mask_path, mask_fname)
-                print(f"functional nifti image (3D) is at: {mask_file}")
-                mask_img = nib.load(mask_file)
-                mask_images_blc.append(mask_img) 
-
-        # ----------Localizer task----------
-        sesName_loc = 'ses-locTask'
-        for iBlc in range(0, nBlock):
-            # ----------Load ROI mask----------
-            mask_path  = path_ROI + '/' + subID_num + '/' + sesName_loc + '/' + 'ROIs/' 
-            mask_fname = ROI_name + '_' + subID_num + '_' + sesName_loc + '_space-' + space + '_T-' + str(int(T*100)) + '_run-0' + str(iBlc+1) + '.nii'
-            mask_file  = os.path.join(mask_path, mask_fname)
-            print(f"functional nifti image (3D) is at: {mask_file}")
-            mask_img = nib.load(mask_file)
-            mask_images_blc.append(mask_img) 
-        # Compute intersection of several masks
-        mask_intersect = intersect_masks(mask_images_blc, threshold=0.5) # threshold=0.5 (default); the intersected mask should have the same shape and affine
-
-        masker = NiftiMasker(
-            mask_img=mask_intersect, 
-            smoothing_fwhm=smoothing_fwhm,
-            standardize=False # standardize=True: z-scores each voxel across samples (trials). 
-        )
+        # ----------Intersected ROI mask (SMT and localizer runs), read from the mask store (AgingReplay_FeatureCache.py)----------
+        mask_intersect = load_mask_intersect(subID_num, ROI_name, nBlock_SMT, nBlock, space, T, path_ROI, maskCache_dir)
 
         # Get mask data as a numpy array
         mask_data = mask_intersect.get_fdata()
@@ -662,59 +312,25 @@ for i_roi in range(0, len(ROI_names)):
         n_voxels_masked = np.count_nonzero(mask_data)
         print(f"Number of voxels in intersected mask: {n_voxels_masked}")
 
-        # ---------- load all the image data and temporarily store it ----------
+        # ---------- load all the image data once: (nTrials, n_voxels, nTRanal), cached next to the per-TR files ----------
         nTrial_iSub = len(imgSeq_mat_longWIT_tgt)
         # ------Check the longWTI trial numbers for each participant------
         print('------ nTrial_iSub = ' + str(nTrial_iSub) + '------')
-        nifti_data_smt_masked_nTRanal = np.zeros((nTrial_iSub, n_voxels_masked, nTRanal))
-        for i_tr in range(0, nTRanal):
-            # ----------Load reorganized func----------
-            smtData_filename = smtDatas_saveDir + '/' + subID_num + '-' + subID_str + '-' + ROI_name + '_space-' + space + '_signalT-' + str(int(T*100)) + '-TR' + str(i_tr) + "-nifti_data_smt.nii.gz"
-            nifti_data_smt = nib.load(smtData_filename) # X*Y*Z*nTrials
-
-            # --------Convert the 4D Nifti image into 2D masked data (n_samples, n_voxels)
-            masker_train = masker
-            nifti_data_smt_masked = masker_train.fit_transform(nifti_data_smt) # shape=(nTrials, n_voxels)
-            nifti_data_smt_masked_nTRanal[:, :, i_tr] = nifti_data_smt_masked
+        # standardize=False: no z-scoring of each voxel across samples (trials)
+        nifti_data_smt_masked_nTRanal = load_smt_tensor(
+            smtDatas_saveDir, subID_num, subID_str, ROI_name, space, T, nTRanal,
+            mask_intersect, smoothing_fwhm, masker_standardize=False
+        )
 
         # -------------------- Cross-stage (Encoding vs. WTI) across trial correlations --------------------
         # ---------- Images ----------
         crossCorrelation_img_iSub      = np.zeros((nTR_p, nTR_p, nSeq, n_repeats))
         crossCosineSimilarity_img_iSub = np.zeros((nTR_p, nTR_p, nSeq, n_repeats))
         for i_seq in range(0, nSeq):
-            trial_numbers = trial_indices_img_per_seq[i_seq]
-            n_trials      = len(trial_numbers)
-            half          = n_trials // 2
-
-            # ---------- fMRI data from the Encoding stage ----------
-            for i_tr_from in range(0, nTR_p):
-                nifti_smt_from = nifti_data_smt_masked_nTRanal[:, :, i_tr_from]
-                
-                # ---------- fMRI data from the WTI stage ----------
-                for i_tr_to in range(0, nTR_p):
-                    nifti_smt_to = nifti_data_smt_masked_nTRanal[:, :, i_tr_to]
-            
-                    for i_rep in range(0, n_repeats):
-                        permuted = np.random.permutation(trial_numbers)
-                        split1 = permuted[:half]
-                        split2 = permuted[half:]  
-
-                        nifti_smt_from_ii = np.nanmean(nifti_smt_from[split1, :], axis=0) # average across trials
-                        nifti_smt_to_ii   = np.nanmean(nifti_smt_to[split2, :], axis=0)
-
-                        # ------ calculate correlation coefficient ------
-                        # zscore is not necessary for correlation calculation
-                        nifti_smt_from_ii_z = zscore(nifti_smt_from_ii, axis=0, ddof=1)  # zscore across voxles
-                        nifti_smt_to_ii_z   = zscore(nifti_smt_to_ii,   axis=0, ddof=1)
-                        corr = np.corrcoef(nifti_smt_from_ii_z, nifti_smt_to_ii_z)[0, 1]
-                        crossCorrelation_img_iSub[i_tr_from, i_tr_to, i_seq, i_rep] = corr   
-                        
-                        # ------ calculate cosine similarity ------
-                        # mean-center across voxels
-                        nifti_smt_from_ii_c = nifti_smt_from_ii - np.mean(nifti_smt_from_ii)
-                        nifti_smt_to_ii_c   = nifti_smt_to_ii   - np.mean(nifti_smt_to_ii)
-                        cos_sim             = cosine_similarity(nifti_smt_from_ii_c, nifti_smt_to_ii_c) 
-                        crossCosineSimilarity_img_iSub[i_tr_from, i_tr_to, i_seq, i_rep] = cos_sim
+            corr, cos_sim = split_half_cross_corr(nifti_data_smt_masked_nTRanal, trial_indices_img_per_seq[i_seq],
+                                                  nTR_p, n_repeats, rng=rng)
+            crossCorrelation_img_iSub[:, :, i_seq, :]      = corr
+            crossCosineSimilarity_img_iSub[:, :, i_seq, :] = cos_sim
         
         crossCorrelation_img_iSub_avg = np.nanmean(
             crossCorrelation_img_iSub,
@@ -729,38 +345,10 @@ for i_roi in range(0, len(ROI_names)):
         crossCorrelation_pos_iSub      = np.zeros((nTR_p, nTR_p, nSeq, n_repeats))
         crossCosineSimilarity_pos_iSub = np.zeros((nTR_p, nTR_p, nSeq, n_repeats))
         for i_seq in range(0, nSeq):
-            trial_numbers = trial_indices_pos_per_seq[i_seq]
-            n_trials      = len(trial_numbers)
-            half          = n_trials // 2
-
-            # ---------- fMRI data from the Encoding stage ----------
-            for i_tr_from in range(0, nTR_p):
-                nifti_smt_from = nifti_data_smt_masked_nTRanal[:, :, i_tr_from]
-                
-                # ---------- fMRI data from the WTI stage ----------
-                for i_tr_to in range(0, nTR_p):
-                    nifti_smt_to = nifti_data_smt_masked_nTRanal[:, :, i_tr_to]
-            
-                    for i_rep in range(0, n_repeats):
-                        permuted = np.random.permutation(trial_numbers)
-                        split1 = permuted[:half]
-                        split2 = permuted[half:]  
-
-                        nifti_smt_from_ii = np.nanmean(nifti_smt_from[split1, :], axis=0)
-                        nifti_smt_to_ii   = np.nanmean(nifti_smt_to[split2, :], axis=0)
-
-                        # ------ calculate correlation coefficient ------
-                        nifti_smt_from_ii_z = zscore(nifti_smt_from_ii, axis=0, ddof=1) 
-                        nifti_smt_to_ii_z   = zscore(nifti_smt_to_ii,   axis=0, ddof=1)
-                        corr = np.corrcoef(nifti_smt_from_ii_z, nifti_smt_to_ii_z)[0, 1]
-                        crossCorrelation_pos_iSub[i_tr_from, i_tr_to, i_seq, i_rep] = corr  
-
-                        # ------ calculate cosine similarity ------
-                        # mean-center across voxels
-                        nifti_smt_from_ii_c = nifti_smt_from_ii - np.mean(nifti_smt_from_ii)
-                        nifti_smt_to_ii_c   = nifti_smt_to_ii   - np.mean(nifti_smt_to_ii)
-                        cos_sim             = cosine_similarity(nifti_smt_from_ii_c, nifti_smt_to_ii_c) 
-                        crossCosineSimilarity_pos_iSub[i_tr_from, i_tr_to, i_seq, i_rep] = cos_sim
+            corr, cos_sim = split_half_cross_corr(nifti_data_smt_masked_nTRanal, trial_indices_pos_per_seq[i_seq],
+                                                  nTR_p, n_repeats, rng=rng)
+            crossCorrelation_pos_iSub[:, :, i_seq, :]      = corr
+            crossCosineSimilarity_pos_iSub[:, :, i_seq, :] = cos_sim
         
         crossCorrelation_pos_iSub_avg = np.nanmean(
             crossCorrelation_pos_iSub,
@@ -795,5 +383,8 @@ for i_roi in range(0, len(ROI_names)):
         crossCosinePos_filename = crossCorr_saveDir + '/' + subID_num + '-' + subID_str + '-' + ROI_name + '_space-' + space + '_signalT-' + str(int(T*100)) + '-' + standardization_word + '-' + trainData_word + "-crossCosineSimilarity_pos_iSub_pd.csv"
         crossCosineSimilarity_pos_iSub_pd.to_csv(path_or_buf = crossCosinePos_filename) 
 
+    # --------Run the subjects on the worker pool (range(6, run_subLen)); each subject saves its own files--------
+    run_subjects(checkpoint.wrap(crossCorr_subject, subject_unit, subject_inputs), range(6, run_subLen), n_workers)
+
            
 print("\nAll cross-corrleation on SMT data completed successfully.\n")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Subject-level worker pool for the *_ROILoop_HPC.py scripts
+# ========================================================================================================================================================
+# Runs the per-subject body of an ROI/HRF iteration on a pool of worker processes and returns the per-subject results in
+# the order of the subject list, so the group-level table is assembled exactly as in the serial loop.
+#
+# The number of workers defaults to the CPUs of the SLURM task and is capped by the memory of the allocation:
+#   SUBJECT_WORKERS=4 SUBJECT_WORKER_MEM_GB=8 python AgingReplay_LocalizerDecoding_EightCateory_ROILoop_HPC.py VISventral
+# SUBJECT_WORKERS=1 runs the subjects serially in the main process (same as the original loop).
+#
+# Workers are forked, so the subject function can be defined inside the ROI/HRF loops of a script and still see its
+# global state (ROI_name, HRF_peak, paths, ...); only the subject index and the returned results cross process boundaries.
+#
+# A subject that raises does not stop the others: every subject is run, and the first error (in subject order) is raised
+# at the end, so the subjects that did finish have written their outputs / checkpoints (AgingReplay_Checkpoint.py).
+# ========================================================================================================================================================
+
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait
+
+default_worker_mem_gb = 8 # peak memory of one subject (load -> mask -> clean -> decode), in GB
+
+_subject_fn = None # set in the parent right before the pool forks
+
+
+def available_cpus():
+    """CPUs this process may run on (respects the SLURM/cgroup affinity)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memory_limit_gb():
+    """Memory of the SLURM allocation (--mem or --mem-per-cpu), or the physical memory outside SLURM, in GB."""
+    if os.environ.get('SLURM_MEM_PER_NODE'):
+        return float(os.environ['SLURM_MEM_PER_NODE']) / 1024
+    if os.environ.get('SLURM_MEM_PER_CPU'):
+        return float(os.environ['SLURM_MEM_PER_CPU']) * int(os.environ.get('SLURM_CPUS_PER_TASK', 1)) / 1024
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024**3
+
+
+def n_subject_workers(n_workers=None, mem_per_worker_gb=None):
+    """Number of subject workers: requested (or SUBJECT_WORKERS, or all CPUs), capped by memory / mem_per_worker_gb."""
+    if n_workers is None:
+        n_workers = int(os.environ.get('SUBJECT_WORKERS', os.environ.get('SLURM_CPUS_PER_TASK', available_cpus())))
+    if mem_per_worker_gb is None:
+        mem_per_worker_gb = float(os.environ.get('SUBJECT_WORKER_MEM_GB', default_worker_mem_gb))
+    if mem_per_worker_gb > 0:
+        n_workers = min(n_workers, int(memory_limit_gb() // mem_per_worker_gb))
+    return max(1, n_workers)
+
+
+def inner_n_jobs(n_workers):
+    """n_jobs for the parallel steps inside one subject (e.g. cross_validate), so that workers do not oversubscribe the CPUs."""
+    return max(1, available_cpus() // n_workers)
+
+
+def _call_subject_fn(subIdx):
+    return _subject_fn(subIdx)
+
+
+def _raise_first_error(subIdx_list, errors):
+    failed = [subIdx for subIdx, error in zip(subIdx_list, errors) if error is not None]
+    if failed:
+        print(f"------ {len(failed)} of {len(subIdx_list)} subjects failed: subIdx {failed} ------")
+        raise errors[subIdx_list.index(failed[0])]
+
+
+def run_subjects(subject_fn, subIdx_list, n_workers=None, mem_per_worker_gb=None):
+    """
+    Return [subject_fn(subIdx) for subIdx in subIdx_list], computed on a pool of forked worker processes.
+
+    Results come back in the order of subIdx_list regardless of which worker finishes first. If subjects fail, the
+    remaining subjects still run and the first error is raised afterwards.
+    """
+    global _subject_fn
+    subIdx_list = list(subIdx_list)
+    n_workers   = min(n_subject_workers(n_workers, mem_per_worker_gb), len(subIdx_list))
+    results, errors = [], []
+    if n_workers <= 1:
+        for subIdx in subIdx_list:
+            try:
+                results.append(subject_fn(subIdx))
+                errors.append(None)
+            except Exception as error:
+                print(f"------ subIdx {subIdx} failed: {error!r} ------")
+                results.append(None)
+                errors.append(error)
+        _raise_first_error(subIdx_list, errors)
+        return results
+
+    print(f"------ running {len(subIdx_list)} subjects on {n_workers} workers ------")
+    _subject_fn = subject_fn
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('fork')) as executor:
+            futures = [executor.submit(_call_subject_fn, subIdx) for subIdx in subIdx_list]
+            wait(futures)
+    finally:
+        _subject_fn = None
+    errors = [future.exception() for future in futures]
+    _raise_first_error(subIdx_list, errors)
+    return [future.result() for future in futures]
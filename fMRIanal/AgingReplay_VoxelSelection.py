@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Reliability-based voxel selection for the localizer decoders
+# ========================================================================================================================================================
+# Split-half reliability of each voxel's condition profile: the condition means of one half of the training samples are
+# correlated (across the 8 conditions) with those of the other half, for all voxels at once. The top fraction of voxels
+# is kept (--top-frac in the decoding scripts).
+#
+# Halves: odd vs. even runs when the run labels are given; otherwise the first vs. second half of each condition's samples
+# in their original order, which for the run-by-run stacked localizer data is early vs. late runs. The latter needs only
+# (X, y), so ReliabilitySelector can sit inside a sklearn Pipeline and is re-fitted within every LOGO training fold.
+# ========================================================================================================================================================
+
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+
+
+def split_half_weights(y, groups=None):
+    """Two (n_conditions, n_samples) averaging matrices, one per half, and the condition labels."""
+    y = np.asarray(y)
+    classes, y_idx = np.unique(y, return_inverse=True)
+    n_samples = len(y)
+    if groups is not None:
+        # odd vs. even runs (in the order of the sorted run labels)
+        _, run_idx = np.unique(np.asarray(groups), return_inverse=True)
+        half = run_idx % 2
+    else:
+        # rank of each sample within its condition -> first vs. second half of the condition's samples
+        order    = np.argsort(y_idx, kind='stable')
+        counts   = np.bincount(y_idx, minlength=len(classes))
+        starts   = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        rank     = np.empty(n_samples, dtype=int)
+        rank[order] = np.arange(n_samples) - starts[y_idx[order]]
+        half = (rank >= counts[y_idx] // 2).astype(int)
+
+    W = np.zeros((2, len(classes), n_samples))
+    W[half, y_idx, np.arange(n_samples)] = 1.0
+    W /= np.maximum(W.sum(axis=2, keepdims=True), 1.0)
+    return W[0], W[1], classes
+
+
+def voxel_reliability(X, y, groups=None):
+    """Per-voxel split-half correlation of the condition profiles, shape (n_voxels,); NaN for flat voxels."""
+    X = np.asarray(X)
+    W_a, W_b, _ = split_half_weights(y, groups)
+    A = W_a @ X # (n_conditions, n_voxels); float64 weights, so accumulated in float64 for float32 X as well
+    B = W_b @ X
+    A -= A.mean(axis=0, keepdims=True)
+    B -= B.mean(axis=0, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.einsum('cv,cv->v', A, B) / np.sqrt(np.einsum('cv,cv->v', A, A) * np.einsum('cv,cv->v', B, B))
+
+
+def select_top_voxels(X, y, top_frac, groups=None):
+    """Sorted indices of the top_frac most reliable voxels (all voxels if top_frac is None or >= 1)."""
+    n_voxels = np.shape(X)[1]
+    if top_frac is None or top_frac >= 1:
+        return np.arange(n_voxels)
+    n_keep = max(1, int(np.ceil(top_frac * n_voxels)))
+    reliability = np.nan_to_num(voxel_reliability(X, y, groups), nan=-np.inf)
+    return np.sort(np.argpartition(-reliability, n_keep - 1)[:n_keep])
+
+
+class ReliabilitySelector(TransformerMixin, BaseEstimator):
+    """Keep the top_frac most reliable voxels of the training data (split-half reliability, see voxel_reliability)."""
+
+    def __init__(self, top_frac=None):
+        self.top_frac = top_frac
+
+    def fit(self, X, y, groups=None):
+        self.voxel_idx_ = select_top_voxels(X, y, self.top_frac, groups)
+        return self
+
+    def transform(self, X):
+        if self.top_frac is None or self.top_frac >= 1:
+            return X
+        return np.asarray(X)[:, self.voxel_idx_]
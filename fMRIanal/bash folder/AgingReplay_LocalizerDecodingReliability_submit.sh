@@ -28,13 +28,28 @@ ROI_NAME=${ROIs[$SLURM_ARRAY_TASK_ID]}
 
 # default if not provided
 TOP_FRAC=${TOP_FRAC:-0.20}
+# logreg | dual-logreg | dual-ridge (dual: fitted in sample space, for wide ROIs such as wholeBrain)
+DECODER=${DECODER:-logreg}
+# within-run label shuffles per subject x HRF peak (0: no permutation test; fast with DECODER=dual-ridge TOP_FRAC=1)
+N_PERM=${N_PERM:-0}
+
+# --- Precision of the cached features (float32 halves their memory; use float64 to reproduce older runs) ---
+export FEATURE_DTYPE=${FEATURE_DTYPE:-float32}
+
+# --- Subject-level worker pool: one worker per CPU, capped by --mem / SUBJECT_WORKER_MEM_GB ---
+export SUBJECT_WORKERS=${SUBJECT_WORKERS:-$SLURM_CPUS_PER_TASK}
+export SUBJECT_WORKER_MEM_GB=${SUBJECT_WORKER_MEM_GB:-8}
 
 echo "Reliability-based decoding for ROI: $ROI_NAME"
 echo "Task ID: $SLURM_ARRAY_TASK_ID"
 echo "top-frac: $TOP_FRAC"
+echo "decoder: $DECODER"
+echo "permutations: $N_PERM"
 
 # --- Run Python script with ROI name ---
 python AgingReplay_LocalizerDecoding_EightCateory_ROILoop_HPC.py \
   --roi "$ROI_NAME" \
-  --top-frac "$TOP_FRAC"
+  --top-frac "$TOP_FRAC" \
+  --decoder "$DECODER" \
+  --n-perm "$N_PERM"
   
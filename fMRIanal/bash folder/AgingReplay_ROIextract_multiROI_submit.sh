@@ -0,0 +1,44 @@
+#!/bin/bash
+#SBATCH --job-name=ROIextractMulti_%A_%a
+#SBATCH --output=/home/mpib/ren/logs/ROIextractMulti_%A_%a.out
+#SBATCH --error=/home/mpib/ren/logs/ROIextractMulti_%A_%a.err
+#SBATCH --partition=long
+#SBATCH --nodes=1
+#SBATCH --cpus-per-task=4
+#SBATCH --mem=16G
+#SBATCH --array=3-109%20       # one job per subject (all ROIs in one pass)
+#SBATCH --time=12:00:00
+#SBATCH --mail-type=NONE
+
+# Fill the feature cache before the ROI array jobs:
+#   JOB_ID=$(sbatch --parsable AgingReplay_ROIextract_multiROI_submit.sh)
+#   sbatch --dependency=afterok:${JOB_ID} AgingReplay_LocalizerDecodingReliability_submit.sh
+
+# --- Load modules ---
+module load conda/24.3.0
+conda activate nipype_env
+
+# --- Move to your working directory ---
+cd /home/mpib/ren/rxj-neurocode/AgingStudy/AgingStudy-fMRI-data/fMRI-code
+
+# --- Precision of the cached features (float32 halves their memory; use float64 to reproduce older runs) ---
+export FEATURE_DTYPE=${FEATURE_DTYPE:-float32}
+
+# --- ROIs extracted together from each run ---
+ROIs=(VISventral VISlow MTL HPC ERH PFCdv PFCdorsoL PFCventroL ventricles)
+
+echo "Multi-ROI extraction for subject index: $SLURM_ARRAY_TASK_ID"
+echo "ROIs: ${ROIs[*]}"
+
+# --- smoothing 6 mm / T=0.3 (decoding) and 2 mm / T=0 (SeqAnal, RSA): one call per pair, not the 2x2 product ---
+python AgingReplay_ROIextract_multiROI.py \
+  --subj-idx "$SLURM_ARRAY_TASK_ID" \
+  --rois "${ROIs[@]}" \
+  --smoothing-fwhm 6 \
+  --T 0.3
+
+python AgingReplay_ROIextract_multiROI.py \
+  --subj-idx "$SLURM_ARRAY_TASK_ID" \
+  --rois "${ROIs[@]}" \
+  --smoothing-fwhm 2 \
+  --T 0
@@ -28,9 +28,9 @@ conda activate "${ENV_PATH}"
 conda install -y \
   --solver=classic \
   --override-channels -c conda-forge \
-  numpy scipy pandas seaborn matplotlib scikit-learn nilearn nibabel
+  numpy scipy pandas seaborn matplotlib scikit-learn nilearn nibabel pyarrow
 
 python - <<'PY'
-import numpy, scipy, seaborn, pandas, sklearn, nilearn, nibabel
+import numpy, scipy, seaborn, pandas, sklearn, nilearn, nibabel, pyarrow
 print("All imports OK")
 PY
\ No newline at end of file
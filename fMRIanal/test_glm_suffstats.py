@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # LOBO GLM from per-block sufficient statistics (AgingReplay_glm_mask_cvLOBO_singleSub.py) against nilearn
+# ========================================================================================================================================================
+# On a single block the AR(1) whitening from the sufficient statistics is the one of nilearn's run_glm, so the t-maps
+# must agree to rounding; the fold statistics (totals minus the held-out block) must give the t-maps of the other blocks.
+# Run with: cd fMRIanal && python -m pytest -q test_glm_suffstats.py
+# ========================================================================================================================================================
+
+import numpy as np
+from nilearn.glm.first_level import run_glm
+
+from AgingReplay_glm_mask_cvLOBO_singleSub import (glm_block_stats, sum_block_stats, glm_tmaps_from_stats,
+                                                   glm_tmaps_from_results)
+
+T_ATOL = 1e-10
+
+
+def block_data(n_scans=200, n_regressors=6, n_voxels=500, seed=0):
+    """(X, Y, reg_idx): random regressors plus a constant, AR(1) noise with a voxel-wise coefficient in [0, 0.6)."""
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([rng.standard_normal((n_scans, n_regressors - 1)), np.ones(n_scans)])
+    rho   = rng.uniform(0, 0.6, n_voxels)
+    noise = rng.standard_normal((n_scans, n_voxels))
+    for t in range(1, n_scans):
+        noise[t] += rho * noise[t - 1]
+    Y = 0.3 * X @ rng.standard_normal((n_regressors, n_voxels)) + noise
+    return X, Y, list(range(n_regressors - 1))
+
+
+def test_single_block_matches_run_glm():
+    X, Y, reg_idx = block_data()
+    t_stats   = glm_tmaps_from_stats(glm_block_stats(X, Y), reg_idx)
+    t_nilearn = glm_tmaps_from_results(*run_glm(Y, X, noise_model='ar1', bins=100), reg_idx)
+    assert np.max(np.abs(t_stats - t_nilearn)) <= T_ATOL
+
+
+def test_fold_subtraction():
+    blocks = [block_data(seed=seed) for seed in range(3)]
+    reg_idx = blocks[0][2]
+    stats_blocks = [glm_block_stats(X, Y) for X, Y, _ in blocks]
+    stats_all    = sum_block_stats(stats_blocks)
+
+    # two blocks: holding out one leaves exactly the other, whose t-maps nilearn gives directly
+    stats_pair  = sum_block_stats(stats_blocks[:2])
+    stats_train = {key: stats_pair[key] - stats_blocks[1][key] for key in stats_pair}
+    X, Y, _ = blocks[0]
+    t_nilearn = glm_tmaps_from_results(*run_glm(Y, X, noise_model='ar1', bins=100), reg_idx)
+    assert np.max(np.abs(glm_tmaps_from_stats(stats_train, reg_idx) - t_nilearn)) <= T_ATOL
+
+    # three blocks: every fold equals the sum over its training blocks
+    for test_block in range(3):
+        stats_train = {key: stats_all[key] - stats_blocks[test_block][key] for key in stats_all}
+        expected    = sum_block_stats([stats for i, stats in enumerate(stats_blocks) if i != test_block])
+        assert stats_train['n'] == expected['n'] and stats_train['n_lag'] == expected['n_lag']
+        assert np.max(np.abs(glm_tmaps_from_stats(stats_train, reg_idx) - glm_tmaps_from_stats(expected, reg_idx))) <= 1e-8
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Precision drift of the float32 features (FEATURE_DTYPE, see AgingReplay_FeatureCache.py)
+# ========================================================================================================================================================
+# The same synthetic data are run through the decoding, split-half cross-correlation and RSA code as float32 and as
+# float64; the outputs must stay within the bounds below. Run with: cd fMRIanal && python -m pytest -q test_precision.py
+# ========================================================================================================================================================
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression, RidgeClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from AgingReplay_DecodingCV import logo_cv, check_precision_drift
+from AgingReplay_DualDecoder import DualClassifier
+from AgingReplay_VoxelSelection import ReliabilitySelector
+from AgingReplay_CrossTrialCorr import split_half_cross_corr
+from AgingReplay_RSAEngine import condition_means, correlation_distance, crossnobis_distance, sequence_rsa, position_permutations
+
+ACC_ATOL  = 0.01 # mean LOGO accuracy
+CORR_ATOL = 1e-4 # correlations, distances and betas
+
+conditions = ['0AngRight', '1AngRightup', '2AngUp', '3AngLeftup', '4AngLeft', '5AngLeftdown', '6AngDown', '7AngRightdown']
+
+
+def localizer_data(n_runs=4, n_rep=3, n_voxels=300, snr=0.2, seed=0):
+    """(X float64, labels, runs): condition patterns plus noise, n_rep trials per condition and run."""
+    rng      = np.random.default_rng(seed)
+    patterns = rng.standard_normal((len(conditions), n_voxels))
+    labels   = np.tile(np.repeat(np.arange(len(conditions)), n_rep), n_runs)
+    runs     = np.repeat(np.arange(n_runs), len(conditions) * n_rep)
+    X = snr * patterns[labels] + rng.standard_normal((len(labels), n_voxels)) + 100.0 # BOLD-like offset
+    return X, np.asarray(conditions)[labels], runs
+
+
+@pytest.mark.parametrize('decoder', ['logreg', 'dual-ridge'])
+def test_decoding_accuracy_drift(decoder):
+    X, y, groups = localizer_data()
+    clf = LogisticRegression(solver="lbfgs", penalty="l2") if decoder == 'logreg' else DualClassifier(RidgeClassifier(alpha=1.0))
+    pipeline = Pipeline([("select", ReliabilitySelector(top_frac=None)), ("scaler", StandardScaler()), ("clf", clf)])
+
+    accuracy = {}
+    for dtype in (np.float32, np.float64):
+        accuracy[dtype] = logo_cv(pipeline, X.astype(dtype), y, groups)['folds']['accuracy'].mean()
+    assert abs(accuracy[np.float32] - accuracy[np.float64]) <= ACC_ATOL
+
+    cv_result = logo_cv(pipeline, X.astype(np.float32), y, groups)
+    assert abs(check_precision_drift(pipeline, X.astype(np.float32), y, groups, cv_result, atol=ACC_ATOL) - accuracy[np.float64]) <= 1e-12
+
+
+def test_split_half_cross_corr_drift():
+    rng  = np.random.default_rng(1)
+    data = rng.standard_normal((16, 400, 15)) + 0.5 * rng.standard_normal((1, 400, 1)) + 100.0 # shared pattern, offset
+    data[3, :5, 2] = np.nan # nanmean over trials
+    corr = {}
+    for dtype in (np.float32, np.float64):
+        corr[dtype], _ = split_half_cross_corr(data.astype(dtype), np.arange(0, 16, 2), 15, 200, rng=np.random.default_rng(7))
+    assert np.all(np.isfinite(corr[np.float64]))
+    assert np.max(np.abs(corr[np.float32] - corr[np.float64])) <= CORR_ATOL
+
+
+@pytest.mark.parametrize('rdm_method', ['correlation', 'crossnobis'])
+def test_rsa_drift(rdm_method):
+    X, labels, runs = localizer_data(n_rep=4)
+    sequences  = [tuple(conditions[:5]), tuple(conditions[3:])]
+    model_rdms = {seq: np.abs(np.subtract.outer(np.arange(5), np.arange(5))).astype(float) for seq in sequences}
+
+    dist, results = {}, {}
+    for dtype in (np.float32, np.float64):
+        if rdm_method == 'crossnobis':
+            dist[dtype], valid_labels = crossnobis_distance(X.astype(dtype), labels, runs, conditions)
+        else:
+            means, valid_labels = condition_means(X.astype(dtype), labels, conditions)
+            dist[dtype] = correlation_distance(means)
+        results[dtype], skipped = sequence_rsa(dist[dtype], valid_labels, sequences, model_rdms, position_permutations(5))
+        assert skipped == []
+
+    scale = np.max(np.abs(dist[np.float64]))
+    assert np.max(np.abs(dist[np.float32] - dist[np.float64])) <= CORR_ATOL * scale
+    for res_32, res_64 in zip(results[np.float32], results[np.float64]):
+        assert abs(res_32['beta'] - res_64['beta']) <= CORR_ATOL
+        assert abs(res_32['corr'] - res_64['corr']) <= CORR_ATOL
+        assert res_32['p_value'] == res_64['p_value']
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Checks of the batched RSA engine (AgingReplay_RSAEngine.py) against explicit loops
+# ========================================================================================================================================================
+# Crossnobis distances: Woodbury shrinkage inverse, run-pair weights and the rules for conditions missing from runs.
+# Permutation test: the relabellings of the positions, the batched null betas and the p-value that counts the identity.
+# Run with: cd fMRIanal && python -m pytest -q test_rsa_engine.py
+# ========================================================================================================================================================
+
+import numpy as np
+import pytest
+
+from AgingReplay_RSAEngine import (crossnobis_distance, sequence_rsa, upper_tri, rdm_regression, position_permutations,
+                                   rdm_permutation_test)
+
+conditions = ['cat', 'hat', 'sunflower', 'key', 'castle', 'female', 'cream', 'car']
+
+
+def run_data(n_runs=4, n_rep=3, n_voxels=120, missing=(1, 'car'), seed=0):
+    """(X, labels, runs): n_rep trials per condition and run, without the (run, condition) pair missing."""
+    rng = np.random.default_rng(seed)
+    patterns = rng.standard_normal((len(conditions), n_voxels))
+    labels, runs = [], []
+    for run in range(n_runs):
+        for cond in conditions:
+            if (run, cond) != missing:
+                labels += [cond] * n_rep
+                runs   += [run] * n_rep
+    labels, runs = np.asarray(labels), np.asarray(runs)
+    X = 0.5 * patterns[[conditions.index(lab) for lab in labels]] + rng.standard_normal((len(labels), n_voxels))
+    X[:, :3] *= 3.0 # voxels with more noise
+    return X, labels, runs
+
+
+def crossnobis_loop(X, labels, runs, noise, shrinkage):
+    """Crossnobis distances from an explicit loop over condition pairs and pairs of different runs."""
+    run_ids = np.unique(runs)
+    means, residuals = {}, []
+    for run in run_ids:
+        for cond in conditions:
+            sel = (runs == run) & (labels == cond)
+            if sel.any():
+                means[run, cond] = X[sel].mean(axis=0)
+                residuals.append(X[sel] - means[run, cond])
+    residuals = np.vstack(residuals)
+    S = residuals.T @ residuals / (len(residuals) - len(means))
+    if noise is None:
+        precision = np.eye(X.shape[1])
+    elif noise == 'diag':
+        precision = np.linalg.inv(np.diag(np.diag(S)))
+    else:
+        precision = np.linalg.inv(shrinkage * np.diag(np.diag(S)) + (1 - shrinkage) * S)
+
+    dist = np.zeros((len(conditions), len(conditions)))
+    for i, ci in enumerate(conditions):
+        for j, cj in enumerate(conditions):
+            if i == j:
+                continue
+            values = [
+                (means[a, ci] - means[a, cj]) @ precision @ (means[b, ci] - means[b, cj])
+                for a in run_ids for b in run_ids
+                if a != b and all(key in means for key in [(a, ci), (a, cj), (b, ci), (b, cj)])
+            ]
+            dist[i, j] = np.mean(values) / X.shape[1] if values else np.nan
+    return dist
+
+
+@pytest.mark.parametrize('noise', [None, 'diag', 'shrinkage'])
+def test_crossnobis_matches_loop(noise):
+    X, labels, runs = run_data()
+    dist, valid_labels = crossnobis_distance(X, labels, runs, conditions, noise, shrinkage=0.3)
+    assert valid_labels == conditions
+    reference = crossnobis_loop(X, labels, runs, noise, 0.3)
+    assert np.allclose(dist, reference, rtol=0, atol=1e-10 * np.max(np.abs(reference)))
+    assert np.allclose(dist, dist.T)
+
+
+def test_crossnobis_condition_in_one_run():
+    # 'car' only in run 0: no pair of different runs has it, its distances are NaN and sequences with it are skipped
+    X, labels, runs = run_data(n_runs=2, missing=(1, 'car'))
+    dist, valid_labels = crossnobis_distance(X, labels, runs, conditions)
+    i_car = valid_labels.index('car')
+    others = [i for i in range(len(conditions)) if i != i_car]
+    assert np.all(np.isnan(dist[i_car, others])) and np.all(np.isnan(dist[others, i_car]))
+    assert dist[i_car, i_car] == 0.0
+    assert np.all(np.isfinite(dist[np.ix_(others, others)]))
+
+    sequences  = [('cat', 'hat', 'sunflower', 'key', 'castle'), ('key', 'castle', 'female', 'cream', 'car')]
+    model_rdms = {seq: np.abs(np.subtract.outer(np.arange(5), np.arange(5))).astype(float) for seq in sequences}
+    results, skipped = sequence_rsa(dist, valid_labels, sequences, model_rdms)
+    assert [res['labels'] for res in results] == [list(sequences[0])]
+    assert skipped == [(sequences[1], 'conditions not in two runs')]
+
+
+def test_position_permutations():
+    perms = position_permutations(5)
+    assert perms.shape == (120, 5)
+    assert np.array_equal(perms[0], np.arange(5))
+    assert len(np.unique(perms, axis=0)) == 120
+
+    perms = position_permutations(5, n_perm=50, random_state=3)
+    assert perms.shape == (50, 5)
+    assert np.array_equal(perms[0], np.arange(5))
+    assert np.all(np.sort(perms, axis=1) == np.arange(5))
+
+
+def test_rdm_permutation_test_matches_loop():
+    rng    = np.random.default_rng(2)
+    model  = np.stack([np.abs(np.subtract.outer(np.arange(5), np.arange(5))).astype(float), rng.random((5, 5))])
+    model  = (model + model.transpose(0, 2, 1)) / 2
+    neural = model + 0.3 * rng.standard_normal(model.shape)
+    neural = (neural + neural.transpose(0, 2, 1)) / 2
+    perms  = position_permutations(5)
+
+    null, p_value = rdm_permutation_test(upper_tri(neural), model, perms)
+    assert null.shape == (2, 120)
+    assert np.allclose(null[:, 0], rdm_regression(upper_tri(neural), upper_tri(model))['beta'], rtol=0, atol=1e-10)
+    for i_seq in range(2):
+        loop = [rdm_regression(upper_tri(neural[i_seq])[None], upper_tri(model[i_seq][np.ix_(perm, perm)]))['beta'][0]
+                for perm in perms]
+        assert np.allclose(null[i_seq], loop, rtol=0, atol=1e-10)
+        # the identity is one of the 120 relabellings, so p >= 1/120
+        assert p_value[i_seq] == np.sum(np.asarray(loop) >= loop[0] - 1e-12) / 120
+        assert p_value[i_seq] >= 1 / 120
+
+
+def test_rdm_permutation_test_counts_identity():
+    # neural RDM equal to the |i-j| model: the observed beta is the maximum, reached by the identity and the reversal
+    model = np.abs(np.subtract.outer(np.arange(5), np.arange(5))).astype(float)[None]
+    null, p_value = rdm_permutation_test(upper_tri(model), model, position_permutations(5))
+    assert np.isclose(null[0, 0], 1.0) and np.all(null[0] <= null[0, 0] + 1e-12)
+    assert p_value[0] == 2 / 120